@@ -0,0 +1,97 @@
+# Downloads message attachments concurrently and archives them into a single .zip file.
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, IO, Tuple
+from zipfile import ZIP_STORED, ZipFile
+from http_client import get_session
+import aiohttp
+import asyncio
+import discord
+import logging
+import shutil
+
+
+logger = logging.getLogger('snuggly')
+
+CHUNK_SIZE = 64 * 1024
+
+# Downloads are buffered in memory up to this size and spill over to disk beyond it,
+# which bounds memory use to roughly <concurrency> * SPOOL_SIZE.
+SPOOL_SIZE = 4 * 1024 * 1024
+
+
+@dataclass
+class ArchiveStats:
+    files: int = 0
+    bytes: int = 0
+    failed: int = 0
+
+
+def _copy_into_zip(zip: ZipFile, name: str, body: IO[bytes]):
+    # Attachments are mostly images and videos, which are already compressed, so they are stored as they are.
+    with zip.open(name, "w", force_zip64=True) as entry:
+        shutil.copyfileobj(body, entry, CHUNK_SIZE)
+
+
+async def archive_attachments(messages: AsyncIterator[discord.Message], path: str, concurrency: int = 8) -> ArchiveStats:
+    """
+    Downloads every attachment of <messages> into a new zip file at <path>.
+
+    Up to <concurrency> attachments are downloaded at once over the shared HTTP session, and each response body is
+    read in chunks rather than all at once. Only one entry can be written to a zip file at a time, so the writes are
+    serialized and run on an executor thread to keep disk I/O off the event loop.
+    """
+    session = await get_session()
+    loop = asyncio.get_running_loop()
+    stats = ArchiveStats()
+    write_lock = asyncio.Lock()
+    # A small queue keeps the history reader from getting far ahead of the downloads.
+    queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def download(name: str, url: str):
+        with SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    body.write(chunk)
+            size = body.tell()
+            body.seek(0)
+            async with write_lock:
+                await loop.run_in_executor(None, _copy_into_zip, zip, name, body)
+        stats.files += 1
+        stats.bytes += size
+
+    async def worker():
+        while True:
+            name, url = await queue.get()
+            try:
+                await download(name, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # ValueError covers URLs that can't be requested at all.
+                stats.failed += 1
+                logger.warning(f"Could not download attachment {name}: {e}")
+            finally:
+                queue.task_done()
+
+    async def produce():
+        async for message in messages:
+            for attachment in message.attachments:
+                # Attachment names repeat a lot (image.png...), so entries are prefixed with the message ID.
+                await queue.put((f"{message.id}-{attachment.id}-{attachment.filename}", attachment.url))
+        await queue.join()
+
+    with ZipFile(path, "w", compression=ZIP_STORED, allowZip64=True) as zip:
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        producer = asyncio.create_task(produce())
+        try:
+            # Workers only stop by raising, e.g. when writing to the disk fails. Then the archive can't be finished,
+            # so the error is raised here rather than leaving the producer waiting for workers that are gone.
+            done, _ = await asyncio.wait([producer, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in [producer, *workers]:
+                task.cancel()
+            await asyncio.gather(producer, *workers, return_exceptions=True)
+
+    return stats
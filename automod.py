@@ -0,0 +1,201 @@
+# Removes messages that break a server's auto-moderation rules as soon as they are sent.
+from discord.ext import commands
+from pymongo import ReturnDocument
+from pymongo.database import Database as MongoDatabase
+from database import get_database, run
+from metrics import timed_methods
+from matching import MessageMatcher
+from outbound import INTERACTIVE, NORMAL, get_outbound_queue
+from typing import Dict, List, Optional
+import asyncio
+import discord
+import logging
+
+
+logger = logging.getLogger('snuggly')
+
+# Seconds before the notice about a removed message is deleted as well.
+NOTICE_LIFETIME = 5
+# The rules of a server that hasn't changed them.
+DEFAULT_RULES = {"enabled": False, "terms": [], "urls": False}
+
+
+@timed_methods
+class Database:
+    """
+    Stores every server's auto-moderation rules, one document per server:
+    {"_id": guild_id, "enabled": bool, "terms": [str], "urls": bool}
+    """
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def get_enabled_rules() -> List[dict]:
+        db = Database.create_connection()
+        rules_col = db.automod_rules
+        return await run(lambda: list(rules_col.find({"enabled": True})))
+
+    @staticmethod
+    async def get_rules(guild_id: int) -> Optional[dict]:
+        db = Database.create_connection()
+        return await run(db.automod_rules.find_one, {"_id": guild_id})
+
+    @staticmethod
+    async def update_rules(guild_id: int, update: dict) -> dict:
+        """
+        Applies <update> to the server's rules, creating them if needed, and returns the rules as they are afterwards.
+        """
+        db = Database.create_connection()
+        changed = {field for operator in ("$set", "$addToSet") for field in update.get(operator, {})}
+        pulled = set(update.get("$pullAll", {}))
+        if pulled:
+            # $pullAll can't be combined with $setOnInsert of the same field, and doesn't create the field when it
+            # inserts, so missing rules are created with their defaults first.
+            await run(db.automod_rules.update_one, {"_id": guild_id}, {"$setOnInsert": DEFAULT_RULES}, upsert=True)
+        defaults = {field: default for field, default in DEFAULT_RULES.items() if field not in changed | pulled}
+        if defaults:
+            update["$setOnInsert"] = defaults
+        return await run(
+            db.automod_rules.find_one_and_update,
+            {"_id": guild_id}, update, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+
+
+class AutomodCog(commands.Cog, name="Auto-moderation"):
+    """
+    Checks every message against its server's rules. The rules of every server that has auto-moderation enabled are
+    kept in memory as a compiled matcher, so a message is checked without a database call, in one pass over its text.
+    The matcher is rebuilt whenever one of the commands below changes the rules.
+    """
+
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.matchers: Dict[int, MessageMatcher] = {}
+
+    async def cog_load(self):
+        for rules in await Database.get_enabled_rules():
+            self.load_rules(rules)
+        logger.info(f"Loaded auto-moderation rules for {len(self.matchers)} servers")
+
+    def load_rules(self, rules: dict):
+        # Rules stored before every field was given a default may lack some of them.
+        rules = {**DEFAULT_RULES, **rules}
+        if rules["enabled"] and (rules["terms"] or rules["urls"]):
+            self.matchers[rules["_id"]] = MessageMatcher(rules["terms"], urls=rules["urls"])
+        else:
+            self.matchers.pop(rules["_id"], None)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.guild is None or message.author.bot:
+            return
+        matcher = self.matchers.get(message.guild.id)
+        if matcher is None or not matcher.matches(message.content):
+            return
+        # Moderators are trusted to post whatever they need to.
+        permissions = getattr(message.author, "guild_permissions", None)
+        if permissions is not None and permissions.manage_messages:
+            return
+
+        queue = get_outbound_queue()
+        try:
+            # Removing the message is as urgent as a reply to a command. The notice can wait behind those.
+            await queue.delete(message, priority=INTERACTIVE)
+            notice = await queue.send(
+                message.channel, f"{message.author.mention}, your message was removed by the auto-moderation filter.",
+                priority=NORMAL,
+            )
+            await asyncio.sleep(NOTICE_LIFETIME)
+            await queue.delete(notice, priority=NORMAL)
+        except discord.NotFound:
+            return
+        except discord.Forbidden:
+            logger.warning(f"Not allowed to remove a message in #{message.channel} of {message.guild}")
+
+    async def update_rules(self, ctx, update: dict):
+        rules = await Database.update_rules(ctx.guild.id, update)
+        self.load_rules(rules)
+        await ctx.send(embed=self.describe_rules(rules))
+
+    def describe_rules(self, rules: dict) -> discord.Embed:
+        rules = {**DEFAULT_RULES, **rules}
+        terms = ", ".join(f"`{term}`" for term in sorted(rules["terms"])) or "None"
+        description = (
+            f"**Enabled:** {'Yes' if rules['enabled'] else 'No'}\n"
+            f"**Remove URLs:** {'Yes' if rules['urls'] else 'No'}\n"
+            f"**Banned terms:** {terms}"
+        )
+        return discord.Embed(title="Auto-moderation rules", description=description[:4096], color=discord.Color.blue())
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def automod(self, ctx, enabled: Optional[bool] = None):
+        """
+        Turns auto-moderation on or off for this server, or shows its rules. Requires administrator permissions.
+
+        Usage:
+        > .automod
+        > .automod on
+        > .automod off
+        """
+        if enabled is None:
+            rules = await Database.get_rules(ctx.guild.id)
+            if rules is None:
+                await ctx.send("Auto-moderation hasn't been set up for this server yet.")
+            else:
+                await ctx.send(embed=self.describe_rules(rules))
+            return
+        await self.update_rules(ctx, {"$set": {"enabled": enabled}})
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def automod_urls(self, ctx, enabled: bool):
+        """
+        Sets whether auto-moderation removes messages with URLs in them. Requires administrator permissions.
+
+        Usage:
+        > .automod_urls on
+        > .automod_urls off
+        """
+        await self.update_rules(ctx, {"$set": {"urls": enabled}})
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def automod_add_terms(self, ctx, *terms: str):
+        """
+        Adds terms that auto-moderation removes messages for. Matching is case-insensitive. Requires administrator permissions.
+
+        Usage:
+        > .automod_add_terms spam "buy now"
+        Put a term in quotes if it has spaces in it.
+        """
+        terms = [term.casefold() for term in terms if term]
+        if not terms:
+            await ctx.send("Please specify the terms to add.")
+            return
+        await self.update_rules(ctx, {"$addToSet": {"terms": {"$each": terms}}})
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def automod_remove_terms(self, ctx, *terms: str):
+        """
+        Removes terms from auto-moderation. Requires administrator permissions.
+
+        Usage:
+        > .automod_remove_terms spam "buy now"
+        """
+        terms = [term.casefold() for term in terms if term]
+        if not terms:
+            await ctx.send("Please specify the terms to remove.")
+            return
+        await self.update_rules(ctx, {"$pullAll": {"terms": terms}})
+
+
+async def setup(client):
+    await client.add_cog(AutomodCog(client))
@@ -0,0 +1,137 @@
+# A small in-memory cache used to keep hot database reads out of MongoDB.
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import itertools
+import time
+
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    A least-recently-used cache bounded by entry count and, optionally, by an estimate of the bytes held.
+    Entries older than <ttl> seconds are treated as misses. Hits, misses, evictions and expirations are counted
+    so the limits can be sized from the numbers seen in production.
+
+    The cache isn't thread-safe. It is only ever touched from the event loop.
+
+    A value read from the database on a miss is stored with begin_fill() and fill() rather than set(). If the key is
+    written with set() or invalidate() while the read is running, the read may have seen the old value, so fill()
+    drops it instead of caching it for the whole TTL.
+
+    Usage:
+    > cache = LRUCache(max_entries=1000, max_bytes=10_000_000, ttl=600, sizeof=len)
+    > cache.set("key", "value")
+    > cache.get("key")  # Returns cache.MISSING if the key isn't cached.
+    > token = cache.begin_fill("key")
+    > cache.fill("key", token, await read_from_database("key"))
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 sizeof: Callable[[Any], int] = lambda value: 1) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        # key -> (value, size, expires_at)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> token of the latest fill that is still running for it and hasn't been overtaken by a write
+        self._fills: Dict[Hashable, int] = {}
+        self._fill_tokens = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        value, _, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        "Like get(), but doesn't count as a lookup or mark the entry as recently used."
+        entry = self._entries.get(key)
+        if entry is None or (entry[2] is not None and entry[2] <= time.monotonic()):
+            return MISSING
+        return entry[0]
+
+    def begin_fill(self, key: Hashable) -> int:
+        "Called before <key> is read from the database after a miss. Returns the token to pass to fill()."
+        token = next(self._fill_tokens)
+        self._fills.pop(key, None)
+        if len(self._fills) >= self.max_entries:
+            # A read that failed never calls fill(). Forgetting the oldest fill only means its value won't be cached.
+            del self._fills[next(iter(self._fills))]
+        self._fills[key] = token
+        return token
+
+    def fill(self, key: Hashable, token: int, value: Any) -> bool:
+        """
+        Caches <value>, read for <key> since begin_fill() returned <token>, unless the key has been written since or a
+        newer fill for it has started. Returns whether the value was cached.
+        """
+        if self._fills.get(key) != token:
+            return False
+        self.set(key, value)
+        return True
+
+    def set(self, key: Hashable, value: Any):
+        self._fills.pop(key, None)
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Caching this would push everything else out, so we don't keep it at all.
+            self.invalidate(key)
+            return
+
+        self.invalidate(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, size, expires_at)
+        self.bytes += size
+
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._fills.pop(key, None)
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._fills.clear()
+        self.bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
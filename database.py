@@ -0,0 +1,181 @@
+# Shared MongoDB connection used by every cog.
+from pymongo import IndexModel, MongoClient, monitoring
+from pymongo.collection import Collection
+from pymongo.database import Database as MongoDatabase
+from pymongo.errors import PyMongoError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import asyncio
+import functools
+import os
+import logging
+import threading
+
+
+logger = logging.getLogger('snuggly')
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Keeps running counters for the connection pool so they can be exposed for monitoring.
+    pymongo calls these hooks from its own threads, so every update takes a lock.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def _incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._incr("checked_out")
+
+    def connection_checked_in(self, event):
+        self._incr("checked_out", -1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "in_use": self.checked_out,
+                "created_total": self.created,
+                "closed_total": self.closed,
+                "checkout_failures_total": self.checkout_failures,
+                "pools_cleared_total": self.pools_cleared,
+            }
+
+
+pool_stats = PoolStatsListener()
+
+
+def _create_client() -> MongoClient:
+    # MONGO_URI takes precedence. Otherwise we fall back to MONGO_HOST/MONGO_PORT, which default to the local server.
+    uri = os.environ.get("MONGO_URI")
+    options = {
+        "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 20)),
+        "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000)),
+        "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000)),
+        "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+        "event_listeners": [pool_stats],
+    }
+    if uri:
+        return MongoClient(uri, **options)
+    return MongoClient(
+        host=os.environ.get("MONGO_HOST", "localhost"),
+        port=int(os.environ.get("MONGO_PORT", 27017)),
+        **options,
+    )
+
+
+def get_client() -> MongoClient:
+    """
+    Returns the bot-wide MongoClient, creating it on first use. MongoClient is thread-safe and
+    owns its own connection pool, so a single instance is shared by every cog.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+                logger.info("Created MongoDB client")
+    return _client
+
+
+def get_database() -> MongoDatabase:
+    return get_client()[os.environ.get("MONGO_DB_NAME", "snuggly")]
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns the current connection pool counters, e.g. {"open_connections": 3, "in_use": 1, ...}.
+    """
+    return pool_stats.snapshot()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                # One worker per pooled connection is enough; more workers would just queue up waiting for a socket.
+                workers = int(os.environ.get("MONGO_EXECUTOR_WORKERS", os.environ.get("MONGO_MAX_POOL_SIZE", 20)))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snuggly-db")
+    return _executor
+
+
+async def run(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a blocking pymongo call on the database executor and waits for it without blocking the event loop.
+
+    Usage:
+    > note = await run(notes_col.find_one, {"title": title})
+    > notes = await run(lambda: list(notes_col.find({"user_id": user_id})))
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def create_indexes(collection: Collection, indexes: List[IndexModel]):
+    """
+    Creates the given indexes if they don't exist yet. This is called whenever an extension is loaded, and is a
+    no-op for indexes that are already there. A failure is logged instead of raised, so the bot still starts if,
+    for example, existing documents violate a new unique index or the server can't be reached yet.
+    """
+    try:
+        names = await run(collection.create_indexes, indexes)
+        logger.info(f"Indexes on {collection.name}: {', '.join(names)}")
+    except PyMongoError as e:
+        logger.error(f"Could not create indexes on {collection.name}: {e}")
+
+
+def close_connection():
+    """
+    Closes the shared client and all of its pooled sockets, and stops the database executor. Called once when the bot shuts down.
+    """
+    global _client, _executor
+    with _client_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _client is not None:
+            _client.close()
+            _client = None
+            logger.info("Closed MongoDB client")
@@ -0,0 +1,80 @@
+# Splits text into emoji and everything else, e.g. a poll choice into its emoji and its text.
+from typing import Dict, List, NamedTuple, Optional
+import emoji
+import re
+
+
+# A custom server emoji as it appears in a message, e.g. <:name:123456789012345678> or <a:name:...> when animated.
+CUSTOM_EMOJI_PATTERN = re.compile(r"<a?:\w{2,32}:\d{15,21}>")
+# Marks the end of an emoji in the trie. The empty string can never be a character of the text.
+_END = ""
+# Emoji are often followed by a variation selector that isn't part of the emoji as Discord knows it.
+VARIATION_SELECTOR = "\ufe0f"
+
+_trie: Optional[dict] = None
+
+
+class ParsedText(NamedTuple):
+    text: str
+    emojis: List[str]
+
+
+def get_emoji_trie() -> dict:
+    """
+    Returns a trie of every emoji in the emoji package's database, building it on first use. Emoji can be several code
+    points long (skin tones, flags, ZWJ sequences like family emoji), so they are matched by walking the trie rather
+    than one character at a time.
+    """
+    global _trie
+    if _trie is None:
+        trie: Dict[str, dict] = {}
+        for sequence in emoji.EMOJI_DATA:
+            node = trie
+            for char in sequence:
+                node = node.setdefault(char, {})
+            node[_END] = sequence
+        _trie = trie
+    return _trie
+
+
+def parse_emojis(text: str) -> ParsedText:
+    """
+    Splits <text> into the emoji in it and the rest of the text, in one pass. At every position the longest emoji that
+    starts there wins, so "👍🏽" is one emoji rather than a thumbs up followed by a skin tone. Custom server emoji count too.
+
+    Usage:
+    > parse_emojis("Pizza 🍕")
+    ParsedText(text='Pizza', emojis=['🍕'])
+    """
+    trie = get_emoji_trie()
+    emojis: List[str] = []
+    rest: List[str] = []
+    position, length = 0, len(text)
+    while position < length:
+        char = text[position]
+        if char == "<":
+            match = CUSTOM_EMOJI_PATTERN.match(text, position)
+            if match:
+                emojis.append(match.group())
+                position = match.end()
+                continue
+
+        node = trie.get(char)
+        found, end = None, position
+        scan = position
+        while node is not None:
+            scan += 1
+            if _END in node:
+                found, end = node[_END], scan
+            node = node.get(text[scan]) if scan < length else None
+
+        if found is None:
+            rest.append(char)
+            position += 1
+            continue
+        emojis.append(found)
+        position = end
+        if position < length and text[position] == VARIATION_SELECTOR:
+            position += 1
+
+    return ParsedText("".join(rest).strip(), emojis)
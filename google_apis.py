@@ -1,77 +1,244 @@
-from utils import (
-    change_file_permissions_to_anyone,
-    delete_downloaded_files,
-    delete_file_from_google_drive,
-    download_attachment,
-    upload_to_gdrive,
-)
-import discord
-from discord.errors import HTTPException
-from zipfile import ZipFile
-import asyncio
-from discord.ext import commands
-
-
-class GoogleAPIsCog(commands.Cog, name="Google APIs"):
-
-    def __init__(self, bot) -> None:
-        self.bot = bot
-
-    @commands.command(aliases=["download-attachments", "dl-attachments"])
-    async def download_attachments(self, ctx, channel: discord.TextChannel):
-        """
-        Downloads all attachments in the specified channel.
-        """
-        if channel == None:
-            await ctx.send("Please specify a channel.")
-            return
-
-        await ctx.send(
-            "Downloading attachments from this channel. This may take a long time. Please wait."
-        )
-        with ZipFile(f"{channel.name} - Attachments.zip", "w") as zip:
-            async for message in channel.history(limit=200):
-                for i, attachment in enumerate(message.attachments):
-                    file_name = download_attachment(i, attachment)
-                    print(f"Adding {file_name} to archive...")
-                    zip.write(file_name)
-                    asyncio.sleep(0.1)
-
-            await ctx.send(
-                "Downloaded and Archived all attachments from this channel. Uploading .zip archive to Discord..."
-            )
-            zip.close()
-
-            # Discord only allows file uploads of 8MB maximum. So, we check if our file is too large. It will raise the HTTPException error if the filesize is too large.
-            # If it is too large, we will upload to Google Drive instead, and will give the user a temporary link to download the file. This link will expire in 1 hour
-            # and the file will be deleted.
-            try:
-                await ctx.send(file=discord.File(f"{channel.name} - Attachments.zip"))
-            except HTTPException:
-                await ctx.send(
-                    "File is too large to upload to Discord. Uploading to Google Drive..."
-                )
-
-                result = upload_to_gdrive(zip)
-                await ctx.send(
-                    embed=discord.Embed(
-                        description=f"Finished uploading to Google Drive. Please go to the following link to download the file:\n{result['download_link']}\n\nThis link will automatically expire after **1 hour**."
-                    )
-                )
-
-                # Change perms so anyone can see and download the file.
-                change_file_permissions_to_anyone(result["file_id"])
-
-                # Delete file from GDrive after one hour.
-                await asyncio.sleep(86400)
-                delete_file_from_google_drive(result["file_id"])
-
-        # Deleting downloaded files so we don't waste precious space.
-        delete_downloaded_files()
-
-    @download_attachments.error
-    async def on_command_error(self, ctx, error):
-        await ctx.send("Please specify a channel.")
-
-async def setup(client):
-    await client.add_cog(GoogleAPIsCog(client))
+from utils import (
+    change_file_permissions_to_anyone,
+    delete_files_from_google_drive,
+    run_on_drive_executor,
+    upload_to_gdrive,
+)
+from archiver import archive_attachments
+from bson import ObjectId
+from database import create_indexes, get_database, run
+from metrics import timed_methods
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, IndexModel
+from pymongo.database import Database as MongoDatabase
+from scheduler import DeadlineScheduler
+from typing import List
+import discord
+from discord.errors import HTTPException
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from discord.ext import commands
+
+
+logger = logging.getLogger('snuggly')
+
+DOWNLOAD_CONCURRENCY = int(os.environ.get("ATTACHMENT_DOWNLOAD_CONCURRENCY", 8))
+# Seconds between edits of the upload progress message.
+PROGRESS_INTERVAL = 3
+# How long an uploaded archive stays on Google Drive.
+DRIVE_FILE_LIFETIME = timedelta(hours=float(os.environ.get("DRIVE_FILE_LIFETIME_HOURS", 24)))
+# Temp files are normally removed as soon as the command finishes. This is the backstop for when it doesn't.
+TEMP_FILE_LIFETIME = timedelta(hours=6)
+# A failed cleanup job is retried after this long.
+CLEANUP_RETRY_DELAY = timedelta(minutes=10)
+
+DRIVE_FILE = "drive_file"
+LOCAL_PATH = "local_path"
+
+
+@timed_methods
+class Database:
+    """
+    Stores the cleanup jobs for files the bot has to delete later. Keeping them in the database rather than
+    in a sleeping coroutine means they still run after the bot restarts.
+    """
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def ensure_indexes():
+        db = Database.create_connection()
+        await create_indexes(db.cleanup_jobs, [
+            IndexModel([("due", ASCENDING)], name="due"),
+        ])
+
+    @staticmethod
+    async def add_cleanup_job(kind: str, target: str, due: datetime) -> ObjectId:
+        """
+        param <kind>: Either DRIVE_FILE, in which case <target> is a Google Drive file ID, or LOCAL_PATH for a local file or directory.
+        param <due>: When the target should be deleted.
+        """
+        db = Database.create_connection()
+        jobs_col = db.cleanup_jobs
+        result = await run(jobs_col.insert_one, {"kind": kind, "target": target, "due": due, "attempts": 0})
+        return result.inserted_id
+
+    @staticmethod
+    async def get_pending_cleanup_jobs() -> List[dict]:
+        db = Database.create_connection()
+        jobs_col = db.cleanup_jobs
+        return await run(lambda: list(jobs_col.find({}, {"due": 1})))
+
+    @staticmethod
+    async def get_cleanup_jobs(job_ids: List[ObjectId]) -> List[dict]:
+        db = Database.create_connection()
+        jobs_col = db.cleanup_jobs
+        return await run(lambda: list(jobs_col.find({"_id": {"$in": job_ids}})))
+
+    @staticmethod
+    async def remove_cleanup_jobs(job_ids: List[ObjectId]):
+        db = Database.create_connection()
+        jobs_col = db.cleanup_jobs
+        await run(jobs_col.delete_many, {"_id": {"$in": job_ids}})
+
+    @staticmethod
+    async def postpone_cleanup_jobs(job_ids: List[ObjectId], due: datetime):
+        db = Database.create_connection()
+        jobs_col = db.cleanup_jobs
+        await run(jobs_col.update_many, {"_id": {"$in": job_ids}}, {"$set": {"due": due}, "$inc": {"attempts": 1}})
+
+
+def _remove_local_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class GoogleAPIsCog(commands.Cog, name="Google APIs"):
+
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.cleanup_scheduler = DeadlineScheduler(self.run_cleanup_jobs, name="cleanup")
+
+    async def cog_load(self):
+        jobs = await Database.get_pending_cleanup_jobs()
+        self.cleanup_scheduler.schedule_many((job["_id"], job["due"]) for job in jobs)
+        self.cleanup_scheduler.start()
+
+    async def cog_unload(self):
+        await self.cleanup_scheduler.stop()
+
+    async def schedule_cleanup(self, kind: str, target: str, due: datetime) -> ObjectId:
+        job_id = await Database.add_cleanup_job(kind, target, due)
+        self.cleanup_scheduler.schedule(job_id, due)
+        return job_id
+
+    async def run_cleanup_jobs(self, job_ids: List[ObjectId]):
+        """
+        Runs every cleanup job that is due. Drive deletions are sent together in batch requests. Deleting a file
+        that is already gone counts as success, so a job that runs twice after a crash does no harm.
+        """
+        jobs = await Database.get_cleanup_jobs(job_ids)
+        done, failed = [], []
+
+        drive_jobs = [job for job in jobs if job["kind"] == DRIVE_FILE]
+        if drive_jobs:
+            try:
+                errors = await run_on_drive_executor(delete_files_from_google_drive, [job["target"] for job in drive_jobs])
+            except Exception:
+                logger.exception(f"Could not delete {len(drive_jobs)} files from Google Drive")
+                errors = {job["target"]: True for job in drive_jobs}
+            for job in drive_jobs:
+                (failed if errors.get(job["target"]) else done).append(job["_id"])
+
+        for job in jobs:
+            if job["kind"] == LOCAL_PATH:
+                try:
+                    _remove_local_path(job["target"])
+                    done.append(job["_id"])
+                except OSError:
+                    logger.exception(f"Could not remove {job['target']}")
+                    failed.append(job["_id"])
+
+        if done:
+            await Database.remove_cleanup_jobs(done)
+        if failed:
+            retry_at = datetime.now() + CLEANUP_RETRY_DELAY
+            await Database.postpone_cleanup_jobs(failed, retry_at)
+            for job_id in failed:
+                self.cleanup_scheduler.schedule(job_id, retry_at)
+
+    @commands.command(aliases=["download-attachments", "dl-attachments"])
+    async def download_attachments(self, ctx, channel: discord.TextChannel, limit: int = None):
+        """
+        Downloads all attachments in the specified channel.
+
+        Usage:
+        > .download_attachments #channel
+        > .download_attachments #channel 500
+        Optionally give the number of recent messages to look through. All messages are looked through by default.
+        """
+        if channel == None:
+            await ctx.send("Please specify a channel.")
+            return
+
+        await ctx.send(
+            "Downloading attachments from this channel. This may take a long time. Please wait."
+        )
+        temp_dir = tempfile.mkdtemp(prefix="snuggly-")
+        zip_path = os.path.join(temp_dir, f"{channel.name} - Attachments.zip")
+        # If the bot stops before this command finishes, this job removes the downloaded files on a later run.
+        temp_dir_job = await self.schedule_cleanup(LOCAL_PATH, temp_dir, datetime.now() + TEMP_FILE_LIFETIME)
+        try:
+            stats = await archive_attachments(channel.history(limit=limit), zip_path, concurrency=DOWNLOAD_CONCURRENCY)
+            logger.info(f"Archived {stats.files} attachments ({stats.bytes} bytes, {stats.failed} failed) from #{channel.name}")
+
+            await ctx.send(
+                f"Downloaded and Archived {stats.files} attachments from this channel. Uploading .zip archive to Discord..."
+            )
+
+            # Discord only allows file uploads of 8MB maximum. So, we check if our file is too large. It will raise the HTTPException error if the filesize is too large.
+            # If it is too large, we will upload to Google Drive instead, and will give the user a temporary link to download the file. This link will expire after
+            # DRIVE_FILE_LIFETIME and the file will be deleted.
+            try:
+                await ctx.send(file=discord.File(zip_path))
+            except HTTPException:
+                status = await ctx.send(
+                    "File is too large to upload to Discord. Uploading to Google Drive..."
+                )
+                result = await run_on_drive_executor(
+                    upload_to_gdrive, zip_path, progress=self.upload_progress_reporter(status)
+                )
+                # The deletion is scheduled before anything else, so the file can't be left on Drive if a later step fails.
+                await self.schedule_cleanup(DRIVE_FILE, result["file_id"], datetime.now() + DRIVE_FILE_LIFETIME)
+
+                # Change perms so anyone can see and download the file.
+                await run_on_drive_executor(change_file_permissions_to_anyone, result["file_id"])
+
+                hours = DRIVE_FILE_LIFETIME.total_seconds() / 3600
+                await ctx.send(
+                    embed=discord.Embed(
+                        description=f"Finished uploading to Google Drive. Please go to the following link to download the file:\n{result['download_link']}\n\nThis link will automatically expire after **{hours:g} hours**."
+                    )
+                )
+        finally:
+            # Deleting downloaded files so we don't waste precious space.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            self.cleanup_scheduler.cancel(temp_dir_job)
+            await Database.remove_cleanup_jobs([temp_dir_job])
+
+    def upload_progress_reporter(self, status: discord.Message):
+        """
+        Returns a progress callback for upload_to_gdrive(), which edits <status> with the upload's progress.
+        The callback runs on the Drive thread, so the edit is handed over to the event loop, at most once every few seconds.
+        """
+        loop = asyncio.get_running_loop()
+        last_update = 0.0
+
+        def report(uploaded: int, total: int):
+            nonlocal last_update
+            now = time.monotonic()
+            if now - last_update < PROGRESS_INTERVAL and uploaded < total:
+                return
+            last_update = now
+            percent = uploaded * 100 // total if total else 100
+            asyncio.run_coroutine_threadsafe(
+                status.edit(content=f"File is too large to upload to Discord. Uploading to Google Drive... {percent}%"), loop
+            )
+
+        return report
+
+    @download_attachments.error
+    async def on_command_error(self, ctx, error):
+        await ctx.send("Please specify a channel.")
+
+async def setup(client):
+    await Database.ensure_indexes()
+    await client.add_cog(GoogleAPIsCog(client))
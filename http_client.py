@@ -0,0 +1,31 @@
+# The aiohttp session shared by everything in the bot that makes outbound HTTP requests.
+from metrics import http_trace_config
+from typing import Optional
+import aiohttp
+import os
+
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the bot-wide ClientSession, creating it on first use. Sharing one session means sharing its connection
+    pool, so repeated requests to the same host (e.g. Discord's CDN) reuse keep-alive connections.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.environ.get("HTTP_MAX_CONNECTIONS", 64)),
+            limit_per_host=int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 16)),
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[http_trace_config()])
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
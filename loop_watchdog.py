@@ -0,0 +1,213 @@
+# Detects when something blocks the event loop, and records what it was.
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from discord.ext import commands
+from time import perf_counter
+from types import CodeType, FrameType
+from typing import Deque, Dict, List, Optional, Tuple
+import asyncio
+import discord
+import logging
+import os
+import sys
+import threading
+
+
+logger = logging.getLogger('snuggly')
+
+# Stalls longer than this are recorded. Unset or 0 turns the watchdog off.
+WATCHDOG_THRESHOLD_MS = int(os.environ.get("WATCHDOG_THRESHOLD_MS", 0))
+# How many stalls are kept for .stalls. Older ones are dropped.
+WATCHDOG_HISTORY = int(os.environ.get("WATCHDOG_HISTORY", 100))
+# How many of the innermost frames of a stalled stack are kept.
+STACK_DEPTH = 12
+
+
+@dataclass
+class Stall:
+    started_at: datetime
+    # Seconds the loop was blocked for. None while the stall is still going on.
+    duration: Optional[float]
+    cog: Optional[str]
+    command: Optional[str]
+    task: Optional[str]
+    # "file.py:123 in function" for the innermost frames, innermost last.
+    stack: List[str]
+
+    @property
+    def location(self) -> str:
+        if self.command:
+            return f"{self.cog or 'no cog'} / {self.command}"
+        return self.cog or self.task or "unknown"
+
+
+class Watchdog:
+    """
+    A task on the event loop updates a heartbeat every <threshold> / 4 seconds, and a thread checks it just as
+    often. When the heartbeat is older than <threshold>, the loop is stuck in some blocking call: the thread grabs
+    the loop thread's stack right then, while the offender is still on it, and works out which cog and command it
+    belongs to. The stall is recorded once the heartbeat resumes and its duration is known.
+
+    Usage:
+    > watchdog = Watchdog(bot, threshold=0.1)
+    > watchdog.start()
+    > watchdog.worst(5)
+    """
+
+    def __init__(self, bot, threshold: float, history: int = WATCHDOG_HISTORY) -> None:
+        self.bot = bot
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.stalls: Deque[Stall] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._beat = perf_counter()
+        self._stopped = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = perf_counter()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat_forever(), name="watchdog-heartbeat")
+        self._thread = threading.Thread(target=self._watch, name="snuggly-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def worst(self, count: int) -> List[Stall]:
+        with self._lock:
+            stalls = list(self.stalls)
+        return sorted(stalls, key=lambda stall: stall.duration, reverse=True)[:count]
+
+    async def _beat_forever(self):
+        while True:
+            self._beat = perf_counter()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        stall: Optional[Stall] = None
+        stalled_since = 0.0
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            if stall is not None and beat != stalled_since:
+                # The heartbeat that was due <interval> after the last one came late by the length of the stall.
+                stall.duration = max(beat - stalled_since - self.interval, self.threshold)
+                self._record(stall)
+                stall = None
+            if stall is None and perf_counter() - beat > self.threshold:
+                stall, stalled_since = self._capture(), beat
+
+    def _capture(self) -> Stall:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        cog, command = self._attribute(frames)
+        task = asyncio.current_task(self._loop)
+        return Stall(
+            started_at=datetime.now(),
+            duration=None,
+            cog=cog,
+            command=command,
+            task=task.get_name() if task is not None else None,
+            stack=[_describe_frame(frame) for frame in reversed(frames[:STACK_DEPTH])],
+        )
+
+    def _attribute(self, frames: List[FrameType]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns the cog and command whose code is on the stack, innermost first. A command is recognised by its
+        callback, and a listener by its method. Failing both, the cog is the innermost frame in a cog's module.
+        """
+        try:
+            handlers = self._handlers()
+        except RuntimeError:
+            # The loop thread changed the commands while we were reading them.
+            handlers = {}
+        cog_modules = {type(cog).__module__: name for name, cog in list(self.bot.cogs.items())}
+
+        module_cog = None
+        for frame in frames:
+            if frame.f_code in handlers:
+                return handlers[frame.f_code]
+            if module_cog is None:
+                module_cog = cog_modules.get(frame.f_globals.get("__name__"))
+        return module_cog, None
+
+    def _handlers(self) -> Dict[CodeType, Tuple[Optional[str], str]]:
+        handlers = {}
+        for command in list(self.bot.walk_commands()):
+            handlers[command.callback.__code__] = (command.cog_name, command.qualified_name)
+        for name, cog in list(self.bot.cogs.items()):
+            for listener_name, method in cog.get_listeners():
+                handlers[method.__func__.__code__] = (name, listener_name)
+        return handlers
+
+    def _record(self, stall: Stall):
+        with self._lock:
+            self.stalls.append(stall)
+        logger.warning(
+            f"Event loop blocked for {stall.duration * 1000:.0f}ms in {stall.location}:\n" + "\n".join(stall.stack[-4:])
+        )
+
+
+def _describe_frame(frame: FrameType) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+class WatchdogCog(commands.Cog, name="Watchdog"):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.watchdog: Optional[Watchdog] = None
+
+    async def cog_load(self):
+        if WATCHDOG_THRESHOLD_MS > 0:
+            self.watchdog = Watchdog(self.bot, threshold=WATCHDOG_THRESHOLD_MS / 1000)
+            self.watchdog.start()
+            logger.info(f"Watching for event loop stalls longer than {WATCHDOG_THRESHOLD_MS}ms")
+
+    async def cog_unload(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def stalls(self, ctx, count: int = 5):
+        """
+        Shows the longest times the bot was blocked and couldn't respond, with what it was doing. Requires administrator permissions.
+
+        Usage:
+        > .stalls
+        > .stalls 10
+        """
+        if self.watchdog is None:
+            await ctx.send("The watchdog is off. Set WATCHDOG_THRESHOLD_MS to turn it on.")
+            return
+
+        worst = self.watchdog.worst(min(count, 10))
+        if not worst:
+            await ctx.send(f"The bot hasn't been blocked for longer than {WATCHDOG_THRESHOLD_MS}ms.")
+            return
+
+        embed = discord.Embed(title="Longest event loop stalls", color=discord.Color.blue())
+        for stall in worst:
+            stack = "\n".join(stall.stack[-5:])
+            embed.add_field(
+                name=f"{stall.duration * 1000:.0f}ms in {stall.location} ({stall.started_at:%Y-%m-%d %H:%M:%S})"[:256],
+                value=f"```\n{stack[-1000:]}\n```",
+                inline=False,
+            )
+        await ctx.send(embed=embed)
+
+
+async def setup(client):
+    await client.add_cog(WatchdogCog(client))
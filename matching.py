@@ -0,0 +1,111 @@
+# Matches message contents against URLs and lists of banned terms.
+from cache import LRUCache, MISSING
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Set
+import re
+
+
+URL_PATTERN = re.compile(r"[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)")
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton over a list of terms. It finds every term that occurs in a text in one pass over the
+    text, however many terms there are, instead of searching for each term separately. Matching is case-insensitive.
+
+    Usage:
+    > automaton = AhoCorasick(["spam", "example.com"])
+    > automaton.find_all("Visit EXAMPLE.com for spam")
+    {'spam', 'example.com'}
+    """
+
+    def __init__(self, terms: Iterable[str]) -> None:
+        # Every node is a dict of transitions. <outputs> holds the terms that end at each node,
+        # including those reached through the node's failure links.
+        self.transitions: List[Dict[str, int]] = [{}]
+        self.outputs: List[Set[str]] = [set()]
+        self.fail: List[int] = [0]
+        self.terms: FrozenSet[str] = frozenset(term.casefold() for term in terms if term)
+
+        for term in self.terms:
+            node = 0
+            for char in term:
+                next_node = self.transitions[node].get(char)
+                if next_node is None:
+                    next_node = len(self.transitions)
+                    self.transitions[node][char] = next_node
+                    self.transitions.append({})
+                    self.outputs.append(set())
+                    self.fail.append(0)
+                node = next_node
+            self.outputs[node].add(term)
+
+        # The failure links are built breadth-first, so a node's link always points to a shallower node.
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                # Children of the root always fall back to the root.
+                self.fail[child] = self.transitions[fallback].get(char, 0) if node else 0
+                self.outputs[child] |= self.outputs[self.fail[child]]
+
+    def _walk(self, text: str):
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        root = transitions[0]
+        node = 0
+        for char in text.casefold():
+            if node == 0 and char not in root:
+                continue
+            while node and char not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(char, 0)
+            if outputs[node]:
+                yield outputs[node]
+
+    def search(self, text: str) -> bool:
+        "Returns True as soon as any term is found in <text>."
+        for _ in self._walk(text):
+            return True
+        return False
+
+    def find_all(self, text: str) -> Set[str]:
+        found = set()
+        for terms in self._walk(text):
+            found |= terms
+        return found
+
+
+class MessageMatcher:
+    """
+    Matches a message if it contains a URL (when <urls> is True) or any of <terms>.
+    """
+
+    def __init__(self, terms: Iterable[str] = (), urls: bool = False) -> None:
+        self.automaton = AhoCorasick(terms)
+        self.urls = urls
+
+    @property
+    def terms(self) -> FrozenSet[str]:
+        return self.automaton.terms
+
+    def matches(self, text: str) -> bool:
+        if self.urls and URL_PATTERN.search(text):
+            return True
+        return bool(self.automaton.terms) and self.automaton.search(text)
+
+
+# Building an automaton is the expensive part, so each guild's matcher is kept for as long as its rules don't change.
+_matchers = LRUCache(max_entries=1000)
+
+
+def get_matcher(guild_id: int, terms: Iterable[str] = (), urls: bool = False) -> MessageMatcher:
+    terms = frozenset(term.casefold() for term in terms if term)
+    matcher = _matchers.get(guild_id)
+    if matcher is MISSING or matcher.terms != terms or matcher.urls != urls:
+        matcher = MessageMatcher(terms, urls=urls)
+        _matchers.set(guild_id, matcher)
+    return matcher
@@ -0,0 +1,251 @@
+# Timings for the bot's hot paths, served in Prometheus' text format when METRICS_PORT is set.
+from aiohttp import web
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+import aiohttp
+import asyncio
+import functools
+import logging
+import math
+import os
+
+
+logger = logging.getLogger('snuggly')
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# How often event loop lag and gateway latency are sampled, in seconds.
+SAMPLE_INTERVAL = 1.0
+
+# Nothing is recorded until the metrics server is started, so with METRICS_PORT unset every hook returns straight away.
+_enabled = False
+_registry = []
+_runner: Optional[web.AppRunner] = None
+_sampler: Optional[asyncio.Task] = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+def _braced(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Counts observations into buckets, one set of buckets per combination of label values. Observations are only
+    made from the event loop thread, so no locking is needed.
+
+    Usage:
+    > COMMAND_SECONDS = Histogram("snuggly_command_duration_seconds", "Time spent running commands.", labels=("command",))
+    > COMMAND_SECONDS.observe(0.12, "remind")
+    """
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count for each bucket..., count above the last bucket, sum of all observations]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values: str):
+        if not _enabled:
+            return
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in sorted(self._series.items()):
+            labels = _format_labels(self.labels, label_values)
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels}{separator}le="{_format_value(bound)}"}} {cumulative}'
+            yield f"{self.name}_sum{_braced(labels)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{_braced(labels)} {cumulative}"
+
+
+class Gauge:
+    """
+    A value that goes up and down. If <collect> is given, it is called on every scrape and returns the current
+    values as {label values: value}, for things that are cheaper to read when asked than to keep up to date.
+    """
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (), collect: Callable[[], dict] = None) -> None:
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def set(self, value: float, *label_values: str):
+        if _enabled:
+            self._values[label_values] = value
+
+    def render(self) -> Iterator[str]:
+        if self.collect is not None:
+            self._values = dict(self.collect())
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_braced(_format_labels(self.labels, label_values))} {_format_value(value)}"
+
+
+def _pool_stats() -> dict:
+    from database import get_pool_stats
+    return {(name,): value for name, value in get_pool_stats().items()}
+
+
+COMMAND_SECONDS = Histogram("snuggly_command_duration_seconds", "Time spent running a command, after its checks and arguments.", labels=("command", "outcome"))
+DATABASE_SECONDS = Histogram("snuggly_database_call_duration_seconds", "Time spent in a cog's Database method.", labels=("method",))
+DRIVE_SECONDS = Histogram("snuggly_drive_call_duration_seconds", "Time spent in a Google Drive call, including waiting for the Drive thread.", labels=("call",))
+HTTP_SECONDS = Histogram("snuggly_http_request_duration_seconds", "Time until the response headers of an outbound HTTP request arrive.", labels=("method", "host", "status"))
+EVENT_LOOP_LAG = Histogram("snuggly_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+GATEWAY_LATENCY = Gauge("snuggly_gateway_latency_seconds", "Time between a gateway heartbeat and its acknowledgement.")
+MONGO_POOL = Gauge("snuggly_mongo_pool", "MongoDB connection pool counters.", labels=("stat",), collect=_pool_stats)
+
+
+def timed(histogram: Histogram, *label_values: str):
+    """
+    Decorator that records how long every call to an async function takes in <histogram>.
+
+    Usage:
+    > @timed(DATABASE_SECONDS, "reminders.get_due_reminders")
+    > async def get_due_reminders(...):
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not _enabled:
+                return await func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start, *label_values)
+        return wrapper
+    return decorator
+
+
+def timed_methods(cls):
+    """
+    Class decorator for the cogs' Database classes. Every async static method is timed in DATABASE_SECONDS,
+    labelled with the module and method name, e.g. "polling.get_votes".
+    """
+    module = cls.__module__
+    for name, attribute in list(vars(cls).items()):
+        if isinstance(attribute, staticmethod) and asyncio.iscoroutinefunction(attribute.__func__):
+            setattr(cls, name, staticmethod(timed(DATABASE_SECONDS, f"{module}.{name}")(attribute.__func__)))
+    return cls
+
+
+async def before_command(ctx):
+    "Registered with bot.before_invoke. discord.py calls it once a command's checks and argument conversion have passed."
+    if _enabled:
+        ctx.command_started_at = perf_counter()
+
+
+async def after_command(ctx):
+    "Registered with bot.after_invoke, which discord.py calls whether or not the command raised."
+    started_at = getattr(ctx, "command_started_at", None)
+    if started_at is None:
+        return
+    outcome = "error" if ctx.command_failed else "ok"
+    COMMAND_SECONDS.observe(perf_counter() - started_at, ctx.command.qualified_name, outcome)
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    """
+    Returns a TraceConfig that times requests made through an aiohttp session in HTTP_SECONDS. Requests are labelled
+    with their host rather than their path, which would contain message and channel ids.
+    """
+    async def on_request_start(session, context, params):
+        context.started_at = perf_counter() if _enabled else None
+
+    async def on_request_end(session, context, params):
+        if context.started_at is not None:
+            HTTP_SECONDS.observe(perf_counter() - context.started_at, params.method, params.url.host, str(params.response.status))
+
+    async def on_request_exception(session, context, params):
+        if context.started_at is not None:
+            HTTP_SECONDS.observe(perf_counter() - context.started_at, params.method, params.url.host, "error")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def _sample(bot, interval: float = SAMPLE_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+        # Latency is infinite until the first heartbeat has been acknowledged.
+        if math.isfinite(bot.latency):
+            GATEWAY_LATENCY.set(bot.latency)
+
+
+async def start_metrics_server(bot):
+    """
+    Starts recording metrics and serves them at http://METRICS_HOST:METRICS_PORT/metrics. Does nothing if
+    METRICS_PORT isn't set. METRICS_HOST defaults to 127.0.0.1, so the endpoint isn't reachable from outside.
+    """
+    global _enabled, _runner, _sampler
+    port = os.environ.get("METRICS_PORT")
+    if not port or _runner is not None:
+        return
+    host = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, int(port)).start()
+    _enabled = True
+    _sampler = asyncio.create_task(_sample(bot), name="metrics-sampler")
+    logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _enabled, _runner, _sampler
+    _enabled = False
+    if _sampler is not None:
+        _sampler.cancel()
+        _sampler = None
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
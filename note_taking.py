@@ -1,167 +1,309 @@
-# Contains the commands for the note-taking features of the bot.
-from discord.ext import commands
-from pymongo import MongoClient
-from pymongo.cursor import Cursor
-from pymongo.database import Database as MongoDatabase
-import discord
-
-
-class Database:
-    """
-    This class contains all the methods that involve interacting and working with the database. 
-    The bot commands simply call these methods to perform operations on the database.
-    """
-
-    @staticmethod
-    def create_connection() -> MongoDatabase:
-        client = MongoClient(host="localhost", port=27017)
-        bot_db = client.snuggly
-        return bot_db
-
-    @staticmethod
-    def check_notes(user_id: int) -> Cursor:
-        db = Database.create_connection()
-        notes_col = db.notes
-        c = notes_col.find({"user_id": user_id})
-        return c
-
-    @staticmethod
-    def read_note(user_id: int, title: str) -> dict:
-        db = Database.create_connection()
-        notes_col = db.notes
-        note = notes_col.find_one({"user_id": user_id, "title": title})
-        return note
-
-    @staticmethod
-    def add_note(user_id: int, user: str, title: str, content: str) -> bool:
-        db = Database.create_connection()
-        notes_col = db.notes
-        result = notes_col.insert_one({
-            "user_id": user_id,
-            "user": user,
-            "title": title,
-            "content": content
-        })
-
-        return result.acknowledged
-
-    @staticmethod
-    def remove_note(title: str, user_id: int) -> bool:
-        db = Database.create_connection()
-        notes_col = db.notes
-        result = notes_col.delete_one({"title": title})
-        return result.acknowledged
-
-
-class NotesCog(commands.Cog, name="Notes"):
-    def __init__(self, bot) -> None:
-        self.bot = bot
-
-    @commands.command(aliases=["notes"])
-    async def check_notes(self, ctx):
-        """
-        Get all the notes stored in your account.
-        """
-        c = Database.check_notes(user_id=int(ctx.message.author.id))
-
-        items = []
-        if c:
-            for i, note in enumerate(c, start=1):
-                items.append(f"({i}) {note['title']}")
-
-        embed = discord.Embed(
-            description="**YOUR NOTES:**\n\n" + "\n".join(items))
-        await ctx.send(embed=embed)
-
-    @commands.command(aliases=["note"])
-    async def read_note(self, ctx, title: str = None):
-        """
-        Read a specific note in your collection.
-
-        Usage:
-        > .read_note "Note Title"
-        """
-        if title is not None:
-            note = Database.read_note(user_id=int(
-                ctx.message.author.id), title=title)
-            if note is not None:
-                embed = discord.Embed(
-                    description=f"**{note['title']}**\n\n{note['content']}")
-                await ctx.send(embed=embed)
-            else:
-                await ctx.send(
-                    embed=discord.Embed(
-                        description="Either this note does not exist or you entered the wrong title. Try again."
-                    )
-                )
-        else:
-            await ctx.send(
-                embed=discord.Embed(
-                    description="You forgot to enter a title. You need to type the title of the note."
-                )
-            )
-
-    @commands.command(aliases=["writenote"])
-    async def write_note(self, ctx, title: str = None, *, content: str = None):
-        """
-        Add a new note to your collection. 
-
-        Provide the title and the content for the note as well.
-
-        Usage:
-        > .write_note "Title goes here" "Content goes here"
-        """
-        if title is not None and content is not None:
-            Database.add_note(
-                user=str(ctx.message.author),
-                user_id=int(ctx.message.author.id),
-                title=title,
-                content=content,
-            )
-
-            embed = discord.Embed(description=f"**{title}**\n\n{content}")
-            await ctx.send(embed=embed)
-        else:
-            await ctx.send(
-                embed=discord.Embed(
-                    description="""
-                        You forgot to enter either a title or some content for this note. Please try again and enter both a title and the content for this note. 
-                        \nRemember that the title should be enclosed in double quotes, such as, "Title goes here". You don\'t have to enclose the content in double quotes.
-                        """
-                )
-            )
-
-    @commands.command(aliases=["removenote"])
-    async def remove_note(self, ctx, title=None):
-        """
-        This function is used to remove a note from the database.
-
-        param <title>: A string that uniquely identifies the note. Each note has a title.
-        """
-        if title is not None:
-            selected_note = Database.read_note(
-                user_id=int(ctx.message.author.id), title=title
-            )
-            if selected_note is not None:
-                Database.remove_note(
-                    title=title, user_id=int(ctx.message.author.id))
-            else:
-                await ctx.send(
-                    embed=discord.Embed(
-                        description="The title you entered does not match any existing note. Please try again."
-                    )
-                )
-                return
-
-            embed = discord.Embed(description=f"**{title}** has been removed!")
-            await ctx.send(embed=embed)
-        else:
-            await ctx.send(
-                embed=discord.Embed(
-                    description="You did not enter a title. Please enter the title of the note you want to delete."
-                )
-            )
-
-
-async def setup(client):
-    await client.add_cog(NotesCog(client))
+# Contains the commands for the note-taking features of the bot.
+from discord.ext import commands
+from pymongo.database import Database as MongoDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from database import create_indexes, get_database, run
+from metrics import timed_methods
+from cache import LRUCache, MISSING
+from pagination import PaginatedView
+from search import InvertedIndex
+from typing import List, Optional
+import discord
+import os
+
+
+def _note_size(note: Optional[dict]) -> int:
+    # A rough estimate of the memory a cached note holds, based on the length of its text fields.
+    if note is None:
+        return 64
+    return 192 + len(note.get("title", "")) + len(note.get("content", ""))
+
+
+# Caches single notes, keyed by (user_id, title). A note that doesn't exist is cached as None,
+# so repeated lookups for a wrong title don't hit the database either.
+note_cache = LRUCache(
+    max_entries=int(os.environ.get("NOTES_CACHE_MAX_ENTRIES", 10000)),
+    max_bytes=int(os.environ.get("NOTES_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+    ttl=float(os.environ.get("NOTES_CACHE_TTL", 600)),
+    sizeof=_note_size,
+)
+
+# One search index per user, built the first time the user searches and kept up to date as notes change.
+search_index_cache = LRUCache(
+    max_entries=int(os.environ.get("NOTES_SEARCH_MAX_USERS", 1000)),
+    max_bytes=int(os.environ.get("NOTES_SEARCH_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.environ.get("NOTES_CACHE_TTL", 600)),
+    sizeof=lambda index: index.size,
+)
+
+
+@timed_methods
+class Database:
+    """
+    This class contains all the methods that involve interacting and working with the database. 
+    The bot commands simply call these methods to perform operations on the database.
+    """
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def ensure_indexes():
+        db = Database.create_connection()
+        await create_indexes(db.notes, [
+            # Serves the paginated listing (user_id prefix, sorted by title) as well as read_note and remove_note,
+            # and makes titles unique per user.
+            IndexModel([("user_id", ASCENDING), ("title", ASCENDING)], name="user_id_title", unique=True),
+        ])
+
+    @staticmethod
+    async def get_notes_page(user_id: int, after: Optional[str], limit: int) -> List[dict]:
+        """
+        Returns the titles of up to <limit> of the user's notes, in alphabetical order, starting after the title <after>.
+        """
+        db = Database.create_connection()
+        notes_col = db.notes
+        query = {"user_id": user_id}
+        if after is not None:
+            query["title"] = {"$gt": after}
+        return await run(lambda: list(
+            notes_col.find(query, {"_id": 0, "title": 1}).sort("title", ASCENDING).limit(limit)
+        ))
+
+    @staticmethod
+    async def read_note(user_id: int, title: str) -> Optional[dict]:
+        note = note_cache.get((user_id, title))
+        if note is not MISSING:
+            return note
+
+        db = Database.create_connection()
+        notes_col = db.notes
+        # If the note is written while it is being read, the result may be stale and isn't cached.
+        token = note_cache.begin_fill((user_id, title))
+        note = await run(notes_col.find_one, {"user_id": user_id, "title": title})
+        note_cache.fill((user_id, title), token, note)
+        return note
+
+    @staticmethod
+    async def search_notes(user_id: int, query: str, limit: int = 10) -> List[tuple]:
+        """
+        Returns up to <limit> (title, score) pairs for the user's notes that best match <query>.
+        The user's notes are only read from the database when their search index isn't cached yet.
+        """
+        index = search_index_cache.get(user_id)
+        if index is MISSING:
+            # A note written while the index is being built may be missing from it, so then the index isn't cached.
+            token = search_index_cache.begin_fill(user_id)
+            db = Database.create_connection()
+            notes_col = db.notes
+
+            def build_index() -> InvertedIndex:
+                index = InvertedIndex()
+                for note in notes_col.find({"user_id": user_id}, {"_id": 0, "title": 1, "content": 1}):
+                    index.add(note["title"], note["content"])
+                return index
+
+            index = await run(build_index)
+            search_index_cache.fill(user_id, token, index)
+        return index.search(query, limit=limit)
+
+    @staticmethod
+    def _update_search_index(user_id: int, title: str, content: Optional[str]):
+        index = search_index_cache.peek(user_id)
+        if index is MISSING:
+            # Stops an index that is being built right now from being cached without this change.
+            search_index_cache.invalidate(user_id)
+            return
+        if content is None:
+            index.remove(title)
+        else:
+            index.add(title, content)
+        # Setting it again updates the size the cache has on record for this index.
+        search_index_cache.set(user_id, index)
+
+    @staticmethod
+    async def add_note(user_id: int, user: str, title: str, content: str) -> bool:
+        db = Database.create_connection()
+        notes_col = db.notes
+        note = {
+            "user_id": user_id,
+            "user": user,
+            "title": title,
+            "content": content
+        }
+        result = await run(notes_col.insert_one, note)
+
+        # Write-through: the new note is cached straight away.
+        note_cache.set((user_id, title), note)
+        Database._update_search_index(user_id, title, content)
+        return result.acknowledged
+
+    @staticmethod
+    async def remove_note(title: str, user_id: int) -> bool:
+        db = Database.create_connection()
+        notes_col = db.notes
+        result = await run(notes_col.delete_one, {"user_id": user_id, "title": title})
+
+        note_cache.set((user_id, title), None)
+        Database._update_search_index(user_id, title, None)
+        return result.acknowledged
+
+
+class NotesCog(commands.Cog, name="Notes"):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+    @commands.command(aliases=["notes"])
+    async def check_notes(self, ctx):
+        """
+        Get all the notes stored in your account.
+        """
+        user_id = int(ctx.message.author.id)
+        view = PaginatedView(
+            author_id=user_id,
+            title="YOUR NOTES",
+            fetch_page=lambda after, limit: Database.get_notes_page(user_id, after, limit),
+            key=lambda note: note["title"],
+            render=lambda note: note["title"],
+            empty_message="You don't have any notes yet.",
+        )
+        await view.start(ctx)
+
+    @commands.command(aliases=["note"])
+    async def read_note(self, ctx, title: str = None):
+        """
+        Read a specific note in your collection.
+
+        Usage:
+        > .read_note "Note Title"
+        """
+        if title is not None:
+            note = await Database.read_note(user_id=int(
+                ctx.message.author.id), title=title)
+            if note is not None:
+                embed = discord.Embed(
+                    description=f"**{note['title']}**\n\n{note['content']}")
+                await ctx.send(embed=embed)
+            else:
+                await ctx.send(
+                    embed=discord.Embed(
+                        description="Either this note does not exist or you entered the wrong title. Try again."
+                    )
+                )
+        else:
+            await ctx.send(
+                embed=discord.Embed(
+                    description="You forgot to enter a title. You need to type the title of the note."
+                )
+            )
+
+    @commands.command(aliases=["search"])
+    async def search_notes(self, ctx, *, query: str = None):
+        """
+        Search the titles and contents of your notes.
+
+        Usage:
+        > .search_notes groceries milk
+        """
+        if query is None:
+            await ctx.send(
+                embed=discord.Embed(
+                    description="You forgot to enter what you are searching for. Please try again."
+                )
+            )
+            return
+
+        results = await Database.search_notes(user_id=int(ctx.message.author.id), query=query)
+        if results:
+            items = [f"({i}) {title}" for i, (title, _) in enumerate(results, start=1)]
+            embed = discord.Embed(description=f"**NOTES MATCHING \"{query}\":**\n\n" + "\n".join(items))
+        else:
+            embed = discord.Embed(description=f"None of your notes match \"{query}\".")
+        await ctx.send(embed=embed)
+
+    @commands.command(aliases=["writenote"])
+    async def write_note(self, ctx, title: str = None, *, content: str = None):
+        """
+        Add a new note to your collection. 
+
+        Provide the title and the content for the note as well.
+
+        Usage:
+        > .write_note "Title goes here" "Content goes here"
+        """
+        if title is not None and content is not None:
+            try:
+                await Database.add_note(
+                    user=str(ctx.message.author),
+                    user_id=int(ctx.message.author.id),
+                    title=title,
+                    content=content,
+                )
+            except DuplicateKeyError:
+                await ctx.send(
+                    embed=discord.Embed(
+                        description=f"You already have a note titled **{title}**. Please choose a different title."
+                    )
+                )
+                return
+
+            embed = discord.Embed(description=f"**{title}**\n\n{content}")
+            await ctx.send(embed=embed)
+        else:
+            await ctx.send(
+                embed=discord.Embed(
+                    description="""
+                        You forgot to enter either a title or some content for this note. Please try again and enter both a title and the content for this note. 
+                        \nRemember that the title should be enclosed in double quotes, such as, "Title goes here". You don\'t have to enclose the content in double quotes.
+                        """
+                )
+            )
+
+    @commands.command(aliases=["removenote"])
+    async def remove_note(self, ctx, title=None):
+        """
+        This function is used to remove a note from the database.
+
+        param <title>: A string that uniquely identifies the note. Each note has a title.
+        """
+        if title is not None:
+            selected_note = await Database.read_note(
+                user_id=int(ctx.message.author.id), title=title
+            )
+            if selected_note is not None:
+                await Database.remove_note(
+                    title=title, user_id=int(ctx.message.author.id))
+            else:
+                await ctx.send(
+                    embed=discord.Embed(
+                        description="The title you entered does not match any existing note. Please try again."
+                    )
+                )
+                return
+
+            embed = discord.Embed(description=f"**{title}** has been removed!")
+            await ctx.send(embed=embed)
+        else:
+            await ctx.send(
+                embed=discord.Embed(
+                    description="You did not enter a title. Please enter the title of the note you want to delete."
+                )
+            )
+
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def notes_cache_stats(self, ctx):
+        """
+        Shows the hit/miss/eviction counters of the notes cache. Requires administrator permissions.
+        """
+        stats = note_cache.stats()
+        description = "\n".join([f"**{name}:** {value}" for name, value in stats.items()])
+        await ctx.send(embed=discord.Embed(title="Notes cache", description=description, color=discord.Color.blue()))
+
+
+async def setup(client):
+    await Database.ensure_indexes()
+    await client.add_cog(NotesCog(client))
@@ -0,0 +1,314 @@
+# A queue for the messages, reactions, edits and deletions the bot sends, paced to stay within Discord's rate limits.
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import discord
+import functools
+import heapq
+import itertools
+import logging
+import os
+
+
+logger = logging.getLogger('snuggly')
+
+# How many requests are in flight at once, across all routes.
+OUTBOUND_CONCURRENCY = int(os.environ.get("OUTBOUND_CONCURRENCY", 10))
+# Discord allows the bot 50 requests per second in total. Replies that don't go through the queue need some of that.
+GLOBAL_LIMIT = (int(os.environ.get("OUTBOUND_GLOBAL_RATE", 40)), 1.0)
+
+# Discord's limits for each kind of request to one channel, as (requests, per seconds). Discord doesn't publish them
+# and reports them in response headers instead; these are the values it reports for bots.
+ROUTE_LIMITS: Dict[str, Tuple[int, float]] = {
+    "send": (5, 5.0),
+    "edit": (5, 5.0),
+    "react": (1, 0.25),
+    "delete": (5, 1.0),
+    "bulk_delete": (1, 1.0),
+}
+
+# Priority classes. Replies to a command go ahead of background work like reminders, which go ahead of bulk work
+# like moderation over a whole server.
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+# Bulk work never occupies more than this share of the workers, so some are always free for everything else.
+BULK_SHARE = 0.5
+
+Send = Callable[[], Awaitable]
+# A kind of request from ROUTE_LIMITS and what it is sent to, e.g. ("react", channel_id).
+Route = Tuple[str, Hashable]
+
+
+class TokenBucket:
+    "Allows <rate> requests per <per> seconds, in bursts of up to <rate>."
+
+    def __init__(self, rate: int, per: float, now: float) -> None:
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.refill_rate = rate / per
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        "Returns how many seconds it is until a request may be made, 0 if one may be made now."
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.refill_rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "send", "futures", "coalesce_key")
+
+    def __init__(self, priority: int, seq: int, send: Send, future: asyncio.Future, coalesce_key: Optional[Hashable]) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.futures = [future]
+        self.coalesce_key = coalesce_key
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _RouteState:
+    __slots__ = ("route", "bucket", "jobs", "coalescing", "busy", "queued_priority", "timer")
+
+    def __init__(self, route: Route, bucket: Optional[TokenBucket]) -> None:
+        self.route = route
+        self.bucket = bucket
+        # Jobs waiting for this route, most urgent first and in submission order within a priority class.
+        self.jobs: List[_Job] = []
+        # Coalesce key -> the queued job it belongs to.
+        self.coalescing: Dict[Hashable, _Job] = {}
+        self.busy = False
+        # The priority class whose ready list this route is on, or None if it isn't on one.
+        self.queued_priority: Optional[int] = None
+        # Set while the route waits for its bucket to refill.
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class OutboundQueue:
+    """
+    Sends requests to Discord with bounded concurrency, within Discord's rate limits, in order of priority.
+
+    Every request has a route, the kind of request and the channel it goes to. Each route has a token bucket with
+    Discord's limit for it, so requests wait here until Discord would accept them rather than running into 429s
+    and stalling inside discord.py. One request per route is in flight at a time, and requests on the same route
+    are sent in the order they were submitted within their priority class.
+
+    Routes that are ready are handed to the workers in order of priority, and bulk work is limited to BULK_SHARE of
+    the workers, so a server-wide cleanup never delays a reply. Edits of the same message that are still queued
+    are coalesced: only the latest one is sent, and every caller gets its result.
+
+    Usage:
+    > queue = OutboundQueue(concurrency=10)
+    > queue.start()
+    > await queue.send(channel, "Hello", priority=INTERACTIVE)
+    > await queue.submit(("send", channel.id), lambda: channel.send("Hello"))
+    """
+
+    def __init__(self, concurrency: int = OUTBOUND_CONCURRENCY, name: str = "outbound",
+                 route_limits: Dict[str, Tuple[int, float]] = ROUTE_LIMITS, global_limit: Tuple[int, float] = GLOBAL_LIMIT) -> None:
+        self.concurrency = concurrency
+        self.name = name
+        self.route_limits = route_limits
+        self.global_limit = global_limit
+        self.bulk_limit = max(1, min(concurrency - 1, int(concurrency * BULK_SHARE)))
+        self._routes: Dict[Route, _RouteState] = {}
+        self._prune_at = 1024
+        # One list of ready routes per priority class.
+        self._ready: List[Deque[_RouteState]] = [deque(), deque(), deque()]
+        self._wakeup = asyncio.Event()
+        self._global: Optional[TokenBucket] = None
+        self._bulk_in_flight = 0
+        self._seq = itertools.count()
+        self._workers = []
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return sum(len(state.jobs) for state in self._routes.values())
+
+    def start(self):
+        if not self._workers:
+            loop = asyncio.get_running_loop()
+            self._global = TokenBucket(self.global_limit[0], self.global_limit[1], loop.time())
+            self._workers = [
+                asyncio.create_task(self._work(), name=f"{self.name}-{i}") for i in range(self.concurrency)
+            ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for state in self._routes.values():
+            if state.timer is not None:
+                state.timer.cancel()
+                state.timer = None
+
+    def submit(self, route: Route, send: Send, priority: int = NORMAL, coalesce_key: Hashable = None) -> asyncio.Future:
+        """
+        Queues <send>, a function that makes one request on <route>. Returns a future that is resolved with its result,
+        or with its exception if it fails.
+
+        param <coalesce_key>: Identifies what the request changes, e.g. the ID of the message it edits. If a request with
+        the same key is still queued on this route, <send> replaces it, so each such request must carry the whole new state.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        state = self._routes.get(route)
+        if state is None:
+            if len(self._routes) >= self._prune_at:
+                self._prune(loop.time())
+            limit = self.route_limits.get(route[0])
+            bucket = TokenBucket(limit[0], limit[1], loop.time()) if limit else None
+            state = self._routes[route] = _RouteState(route, bucket)
+
+        job = state.coalescing.get(coalesce_key) if coalesce_key is not None else None
+        if job is not None:
+            job.send = send
+            job.futures.append(future)
+            self.coalesced += 1
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heapify(state.jobs)
+        else:
+            job = _Job(priority, next(self._seq), send, future, coalesce_key)
+            heapq.heappush(state.jobs, job)
+            if coalesce_key is not None:
+                state.coalescing[coalesce_key] = job
+        self._make_ready(state)
+        return future
+
+    def send(self, channel: discord.abc.Messageable, *args, priority: int = INTERACTIVE, **kwargs) -> asyncio.Future:
+        return self.submit(("send", channel.id), functools.partial(channel.send, *args, **kwargs), priority)
+
+    def edit(self, message: discord.Message, priority: int = NORMAL, **kwargs) -> asyncio.Future:
+        "Edits <message>. Pass everything the message should show: a queued edit of the same message is replaced by this one."
+        return self.submit(("edit", message.channel.id), functools.partial(message.edit, **kwargs), priority, coalesce_key=message.id)
+
+    def add_reaction(self, message: discord.Message, emoji, priority: int = INTERACTIVE) -> asyncio.Future:
+        return self.submit(("react", message.channel.id), functools.partial(message.add_reaction, emoji), priority)
+
+    def remove_reaction(self, message: discord.Message, emoji, member: discord.abc.Snowflake, priority: int = NORMAL) -> asyncio.Future:
+        return self.submit(("react", message.channel.id), functools.partial(message.remove_reaction, emoji, member), priority)
+
+    def clear_reactions(self, message: discord.Message, priority: int = NORMAL) -> asyncio.Future:
+        return self.submit(("react", message.channel.id), message.clear_reactions, priority)
+
+    def delete(self, message: discord.Message, priority: int = BULK) -> asyncio.Future:
+        return self.submit(("delete", message.channel.id), message.delete, priority)
+
+    def delete_messages(self, channel: discord.TextChannel, messages: List[discord.Message], priority: int = BULK) -> asyncio.Future:
+        return self.submit(("bulk_delete", channel.id), functools.partial(channel.delete_messages, messages), priority)
+
+    def _prune(self, now: float):
+        # Idle routes are forgotten once their bucket is full again, since a new bucket would start out full anyway.
+        self._routes = {
+            route: state for route, state in self._routes.items()
+            if state.busy or state.jobs or state.timer is not None or (state.bucket is not None and not state.bucket.is_full(now))
+        }
+        self._prune_at = max(1024, 2 * len(self._routes))
+
+    def _make_ready(self, state: _RouteState):
+        # Puts the route on the ready list of its most urgent job, or waits for its bucket to refill first.
+        if state.busy or not state.jobs or state.timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = state.bucket.delay(loop.time()) if state.bucket is not None else 0.0
+        if delay > 0:
+            state.timer = loop.call_later(delay, self._bucket_refilled, state)
+            return
+        priority = state.jobs[0].priority
+        if state.queued_priority is not None and state.queued_priority <= priority:
+            return
+        # If the route is already on a less urgent list, that entry goes stale and is skipped.
+        state.queued_priority = priority
+        self._ready[priority].append(state)
+        self._wakeup.set()
+
+    def _bucket_refilled(self, state: _RouteState):
+        state.timer = None
+        self._make_ready(state)
+
+    def _next_route(self) -> Optional[_RouteState]:
+        for priority, ready in enumerate(self._ready):
+            if priority == BULK and self._bulk_in_flight >= self.bulk_limit:
+                continue
+            while ready:
+                state = ready.popleft()
+                if state.queued_priority == priority:
+                    state.queued_priority = None
+                    return state
+        return None
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # The route is only picked once the global limit allows a request, so the most urgent job at that moment gets it.
+            delay = self._global.delay(loop.time())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            state = self._next_route()
+            if state is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._global.take(loop.time())
+
+            job = heapq.heappop(state.jobs)
+            if job.coalesce_key is not None:
+                del state.coalescing[job.coalesce_key]
+            state.busy = True
+            bulk = job.priority == BULK
+            self._bulk_in_flight += bulk
+            try:
+                if state.bucket is not None:
+                    state.bucket.take(loop.time())
+                result = await job.send()
+            except asyncio.CancelledError:
+                for future in job.futures:
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                for future in job.futures:
+                    if not future.cancelled():
+                        future.set_exception(e)
+            else:
+                self.sent += 1
+                for future in job.futures:
+                    if not future.cancelled():
+                        future.set_result(result)
+            finally:
+                state.busy = False
+                self._bulk_in_flight -= bulk
+                self._make_ready(state)
+                # A bulk slot may have been freed, so idle workers look again.
+                self._wakeup.set()
+
+
+_queue: Optional[OutboundQueue] = None
+
+
+def get_outbound_queue() -> OutboundQueue:
+    "Returns the bot's shared outbound queue, starting it on first use."
+    global _queue
+    if _queue is None:
+        _queue = OutboundQueue()
+        _queue.start()
+    return _queue
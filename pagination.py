@@ -0,0 +1,95 @@
+# An embed with Previous/Next buttons that fetches its pages lazily.
+from typing import Any, Awaitable, Callable, List, Optional
+from discord.ext.commands.context import Context
+import discord
+
+
+# Discord rejects embed descriptions longer than 4096 characters, so single lines are cut well below that.
+MAX_LINE_LENGTH = 300
+
+
+class PaginatedView(discord.ui.View):
+    """
+    Shows a listing one page at a time. Pages are fetched on demand with keyset pagination: <fetch_page> is called
+    with the key of the last row on the previous page (None for the first page) and a limit, and returns the rows
+    that come after that key. Only the current page is ever held in memory, and every page costs one indexed query.
+
+    param <fetch_page>: An async function taking (after, limit) and returning a list of rows.
+    param <key>: Returns the pagination key of a row, e.g. its title or _id.
+    param <render>: Turns a row into one line of the embed.
+    """
+
+    def __init__(self, author_id: int, title: str, fetch_page: Callable[[Any, int], Awaitable[List[dict]]],
+                 key: Callable[[dict], Any], render: Callable[[dict], str], page_size: int = 10,
+                 empty_message: str = "Nothing to show.", color: discord.Color = discord.Color.blue(),
+                 timeout: float = 180) -> None:
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.title = title
+        self.fetch_page = fetch_page
+        self.key = key
+        self.render = render
+        self.page_size = page_size
+        self.empty_message = empty_message
+        self.color = color
+        # The key each page starts after. The last element belongs to the page being shown.
+        self.page_starts: List[Any] = [None]
+        self.rows: List[dict] = []
+        self.has_next = False
+        self.message: Optional[discord.Message] = None
+
+    async def load(self):
+        # One extra row is fetched to find out whether there is a next page.
+        rows = await self.fetch_page(self.page_starts[-1], self.page_size + 1)
+        self.has_next = len(rows) > self.page_size
+        self.rows = rows[:self.page_size]
+        self.previous_page.disabled = len(self.page_starts) == 1
+        self.next_page.disabled = not self.has_next
+
+    def embed(self) -> discord.Embed:
+        if not self.rows:
+            return discord.Embed(title=self.title, description=self.empty_message, color=self.color)
+
+        offset = (len(self.page_starts) - 1) * self.page_size
+        lines = []
+        for i, row in enumerate(self.rows, start=offset + 1):
+            line = self.render(row)
+            if len(line) > MAX_LINE_LENGTH:
+                line = line[:MAX_LINE_LENGTH - 3] + "..."
+            lines.append(f"({i}) {line}")
+        embed = discord.Embed(title=self.title, description="\n".join(lines), color=self.color)
+        embed.set_footer(text=f"Page {len(self.page_starts)}")
+        return embed
+
+    async def start(self, ctx: Context):
+        await self.load()
+        if not self.rows or (len(self.page_starts) == 1 and not self.has_next):
+            # Everything fits on one page, so there's nothing to click.
+            await ctx.send(embed=self.embed())
+            self.stop()
+            return
+        self.message = await ctx.send(embed=self.embed(), view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran the command can change pages.", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        if self.message is not None:
+            await self.message.edit(view=None)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.page_starts) > 1:
+            self.page_starts.pop()
+        await self.load()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.has_next and self.rows:
+            self.page_starts.append(self.key(self.rows[-1]))
+        await self.load()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
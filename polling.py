@@ -1,51 +1,364 @@
 from typing import Optional, List
+from collections import Counter
 from discord.ext import commands
 from discord.ext.commands.context import Context
 from discord.ui import View
-from pymongo import MongoClient
-from pymongo.cursor import Cursor
 from pymongo.database import Database as MongoDatabase
-from utils import parse_date_string, convert_date_to_readable_form
-from datetime import datetime
-from typing import Union
+from pymongo import ASCENDING, DeleteOne, IndexModel, ReplaceOne, UpdateOne
+from bson import ObjectId
+from database import create_indexes, get_database, run
+from metrics import timed_methods
+from outbound import INTERACTIVE, get_outbound_queue
+from emoji_parser import get_emoji_trie, parse_emojis
+from pagination import PaginatedView
+from scheduler import DeadlineScheduler
+from utils import DateParseError, parse_date_string, convert_date_to_readable_form
+from user_settings import get_user_timezone
+from datetime import datetime, timedelta
+from typing import Dict, Tuple, Union
+import asyncio
 import discord
 import logging
-import emoji
+import re
 
 
 logger = logging.getLogger('snuggly')
 
+# Votes are written to the database at least this often, in seconds...
+VOTE_FLUSH_INTERVAL = 2
+# ...or as soon as this many are waiting.
+VOTE_FLUSH_BATCH_SIZE = 500
+# A poll that could not be closed stays open, counting votes, and closing it is tried again after this long.
+CLOSE_RETRY_DELAY = timedelta(seconds=60)
+
+@timed_methods
 class Database:
     @staticmethod
     def create_connection() -> MongoDatabase:
-        client = MongoClient(host="localhost", port=27017)
-        bot_db = client.snuggly
-        return bot_db
+        return get_database()
 
     @staticmethod
-    def create_poll(user_id: int, user: str, title: str, choices: list, expiry_date: datetime):
+    async def ensure_indexes():
+        db = Database.create_connection()
+        await create_indexes(db.polls, [
+            # Polls are looked up by their expiry date when they are expired.
+            IndexModel([("expiry_date", ASCENDING)], name="expiry_date"),
+            # Serves the paginated listing of a guild's polls.
+            IndexModel([("guild_id", ASCENDING), ("_id", ASCENDING)], name="guild_id__id"),
+        ])
+        await create_indexes(db.archived_polls, [
+            # Serves the results of closed polls.
+            IndexModel([("message_id", ASCENDING)], name="message_id"),
+        ])
+        await create_indexes(db.poll_votes, [
+            # Every user has at most one vote per poll.
+            IndexModel([("message_id", ASCENDING), ("user_id", ASCENDING)], name="message_id_user_id", unique=True),
+        ])
+
+    @staticmethod
+    async def create_poll(guild_id: int, channel_id: int, message_id: int, user_id: int, user: str, title: str,
+                          choices: list, expiry_date: datetime) -> dict:
         db = Database.create_connection()
         polls_col = db.polls
-        result = polls_col.insert_one({
+        poll = {
+            "guild_id": guild_id,
+            "channel_id": channel_id,
+            "message_id": message_id,
             "user_id": user_id,
             "user": user,
             "title": title,
             "choices": choices,
             "expiry_date": expiry_date,
-        })
-        return result.acknowledged
+        }
+        await run(polls_col.insert_one, poll)
+        return poll
+
+    @staticmethod
+    async def get_open_polls() -> List[dict]:
+        "Returns every poll that hasn't been closed. Closed polls are moved to archived_polls, so this is the whole collection."
+        db = Database.create_connection()
+        polls_col = db.polls
+        return await run(lambda: list(polls_col.find({})))
+
+    @staticmethod
+    async def archive_legacy_polls(polls: List[dict]):
+        """
+        Moves polls that were created before their message IDs were stored to the archived_polls collection. Their
+        messages can't be found, so their votes were never counted and they can't be closed; they are archived as they
+        are, without results. Like archive_poll(), the polls are copied before they are removed.
+        """
+        db = Database.create_connection()
+        polls_col = db.polls
+        now = datetime.now()
+        await run(db.archived_polls.bulk_write, [
+            ReplaceOne({"_id": poll["_id"]}, dict(poll, closed_at=now, legacy=True), upsert=True) for poll in polls
+        ], ordered=False)
+        await run(polls_col.delete_many, {"_id": {"$in": [poll["_id"] for poll in polls]}})
+
+    @staticmethod
+    async def get_votes(message_ids: List[int]) -> List[dict]:
+        db = Database.create_connection()
+        votes_col = db.poll_votes
+        return await run(lambda: list(
+            votes_col.find({"message_id": {"$in": message_ids}}, {"_id": 0, "message_id": 1, "user_id": 1, "emoji": 1})
+        ))
+
+    @staticmethod
+    async def write_votes(votes: Dict[Tuple[int, int], Optional[str]]):
+        """
+        Writes a batch of votes to the ledger with a single bulk write.
+
+        param <votes>: Maps (message_id, user_id) to the emoji the user voted for, or to None if the user took their vote back.
+        """
+        db = Database.create_connection()
+        votes_col = db.poll_votes
+        now = datetime.now()
+        operations = [
+            UpdateOne({"message_id": message_id, "user_id": user_id}, {"$set": {"emoji": choice, "voted_at": now}}, upsert=True)
+            if choice is not None else DeleteOne({"message_id": message_id, "user_id": user_id})
+            for (message_id, user_id), choice in votes.items()
+        ]
+        await run(votes_col.bulk_write, operations, ordered=False)
 
     @staticmethod
-    def get_polls():
+    async def archive_poll(poll_id: ObjectId, results: Dict[str, int]):
+        """
+        Moves a closed poll to the archived_polls collection, with the number of votes for each choice, and removes its votes.
+        The poll is copied before it is removed, so if the bot stops halfway the poll is simply closed again on the next run.
+        """
         db = Database.create_connection()
         polls_col = db.polls
-        return polls_col.find()
+        poll = await run(polls_col.find_one, {"_id": poll_id})
+        if poll is None:
+            return
+        for choice in poll["choices"]:
+            choice["votes"] = results.get(choice["emoji"], 0)
+        poll["closed_at"] = datetime.now()
+        await run(db.archived_polls.replace_one, {"_id": poll_id}, poll, upsert=True)
+        await run(polls_col.delete_one, {"_id": poll_id})
+        await run(db.poll_votes.delete_many, {"message_id": poll["message_id"]})
+
+    @staticmethod
+    async def get_archived_poll(message_id: int) -> Optional[dict]:
+        db = Database.create_connection()
+        return await run(db.archived_polls.find_one, {"message_id": message_id})
+
+    @staticmethod
+    async def get_polls_page(guild_id: int, after: Optional[ObjectId], limit: int) -> List[dict]:
+        """
+        Returns up to <limit> of the guild's polls, oldest first, starting after the poll with the ID <after>.
+        """
+        db = Database.create_connection()
+        polls_col = db.polls
+        query = {"guild_id": guild_id}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return await run(lambda: list(
+            polls_col.find(query, {"title": 1, "user": 1, "expiry_date": 1}).sort("_id", ASCENDING).limit(limit)
+        ))
+
+
+def render_expiry_date(expiry_date) -> str:
+    # Polls created before expiry dates were parsed have the string "1d" instead.
+    if isinstance(expiry_date, datetime):
+        return convert_date_to_readable_form(expiry_date)
+    return "an unknown time"
+
+
+class PollTally:
+    """
+    The votes on one poll, kept in memory so every reaction is counted without a database call.
+    Every user has one vote. Voting for another choice moves the user's vote there.
+    """
+
+    def __init__(self, poll: dict) -> None:
+        self.poll_id: ObjectId = poll["_id"]
+        self.message_id: int = poll["message_id"]
+        self.channel_id: int = poll["channel_id"]
+        self.guild_id: int = poll["guild_id"]
+        self.title: str = poll["title"]
+        self.choices: List[dict] = poll["choices"]
+        self.emojis = {choice["emoji"] for choice in self.choices}
+        self.counts = Counter()
+        # user_id -> emoji
+        self.votes: Dict[int, str] = {}
+
+    @classmethod
+    def from_archive(cls, poll: dict) -> "PollTally":
+        "Rebuilds the final tally of an archived poll, which keeps the number of votes for each choice but not the voters."
+        tally = cls(poll)
+        tally.counts = Counter({choice["emoji"]: choice["votes"] for choice in poll["choices"]})
+        return tally
+
+    def vote(self, user_id: int, emoji: str) -> Optional[str]:
+        "Records the user's vote, and returns the emoji of the vote it replaces, if there was one."
+        previous = self.votes.get(user_id)
+        if previous == emoji:
+            return None
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.votes[user_id] = emoji
+        self.counts[emoji] += 1
+        return previous
+
+    def unvote(self, user_id: int, emoji: str) -> bool:
+        "Takes back the user's vote, if it was for <emoji>. Returns whether it was."
+        if self.votes.get(user_id) != emoji:
+            return False
+        del self.votes[user_id]
+        self.counts[emoji] -= 1
+        return True
+
+    def results_embed(self, final: bool = False) -> discord.Embed:
+        total = sum(self.counts.values())
+        lines = []
+        for choice in self.choices:
+            count = self.counts[choice["emoji"]]
+            percent = count * 100 / total if total else 0
+            bar = "\u2588" * round(percent / 10)
+            lines.append(f"{choice['emoji']} {choice['text']}: **{count}** ({percent:.0f}%) {bar}")
+        heading = "Final results" if final else "Results so far"
+        description = f"{heading}, {total} votes:\n" + "\n".join(lines)
+        return discord.Embed(title=self.title, description=description, color=discord.Color.blue())
 
 
 class PollingCog(commands.Cog, name="Polls"):
-    # TODO: Need to add an event that automatically expires polls, disables reacts on the poll message, and displays the poll results, and then finally deletes the poll from our database.
+    """
+    Open polls are loaded once, when the cog loads. From then on their votes are counted from reaction events, and
+    a DeadlineScheduler keyed by message ID wakes up exactly when the next poll expires. An expired poll's message
+    shows the final results and loses its reactions, and the poll is archived. Polls left over from before poll
+    messages were tracked have no message, guild or votes to go by, so they are archived as soon as they are loaded.
+    """
+
     def __init__(self, bot) -> None:
         self.bot = bot
+        # message_id -> tally of every poll whose votes are being counted
+        self.tallies: Dict[int, PollTally] = {}
+        # Votes that haven't been written to the ledger yet. Only the latest vote of each user on each poll is kept.
+        self.pending_votes: Dict[Tuple[int, int], Optional[str]] = {}
+        self.flush_requested = asyncio.Event()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.expiry_scheduler = DeadlineScheduler(self.expire_polls, name="polls")
+
+    async def cog_load(self):
+        # Built now rather than by the first .poll command.
+        get_emoji_trie()
+        polls = await Database.get_open_polls()
+        legacy = [poll for poll in polls if "message_id" not in poll]
+        if legacy:
+            await Database.archive_legacy_polls(legacy)
+            logger.warning(f"Archived {len(legacy)} polls from before poll messages were tracked, which can't be counted or closed")
+        polls = [poll for poll in polls if "message_id" in poll]
+        for poll in polls:
+            self.tallies[poll["message_id"]] = PollTally(poll)
+        # Polls created before expiry dates were parsed have "1d" as their expiry date. Those are long overdue.
+        now = datetime.now()
+        self.expiry_scheduler.schedule_many(
+            (poll["message_id"], poll["expiry_date"] if isinstance(poll["expiry_date"], datetime) else now)
+            for poll in polls
+        )
+        if self.tallies:
+            for vote in await Database.get_votes(list(self.tallies)):
+                tally = self.tallies[vote["message_id"]]
+                tally.vote(vote["user_id"], vote["emoji"])
+        logger.info(f"Counting votes on {len(self.tallies)} polls")
+        self.flush_task = asyncio.create_task(self.flush_votes_loop())
+        self.expiry_scheduler.start()
+
+    async def cog_unload(self):
+        await self.expiry_scheduler.stop()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush_votes()
+
+    async def expire_polls(self, message_ids: List[int]):
+        await self.bot.wait_until_ready()
+        for message_id in message_ids:
+            tally = self.tallies.get(message_id)
+            if tally is None:
+                continue
+            try:
+                await self.close_poll(tally)
+            except Exception:
+                logger.exception(f"Could not close poll {tally.poll_id}, retrying in {CLOSE_RETRY_DELAY}")
+                self.expiry_scheduler.schedule(message_id, datetime.now() + CLOSE_RETRY_DELAY)
+                continue
+            # Only now that the poll is archived does it stop counting votes. Its pending votes are in the archive.
+            del self.tallies[message_id]
+            self.pending_votes = {
+                key: choice for key, choice in self.pending_votes.items() if key[0] != message_id
+            }
+
+    async def close_poll(self, tally: PollTally):
+        # Clearing the reactions raises a single reaction-clear event, not one removal per reaction, so it doesn't
+        # take any votes away from the tally that is about to be archived.
+        channel = self.bot.get_channel(tally.channel_id)
+        if channel is not None:
+            message = channel.get_partial_message(tally.message_id)
+            try:
+                await get_outbound_queue().edit(message, embed=tally.results_embed(final=True))
+                await get_outbound_queue().clear_reactions(message)
+            except discord.NotFound:
+                pass
+            except discord.Forbidden:
+                logger.warning(f"Not allowed to close the message of poll {tally.poll_id} in #{channel}")
+        await Database.archive_poll(tally.poll_id, dict(tally.counts))
+
+    def record_vote(self, tally: PollTally, user_id: int, emoji: Optional[str]):
+        self.pending_votes[(tally.message_id, user_id)] = emoji
+        if len(self.pending_votes) >= VOTE_FLUSH_BATCH_SIZE:
+            self.flush_requested.set()
+
+    async def flush_votes_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=VOTE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush_votes()
+
+    async def flush_votes(self):
+        if not self.pending_votes:
+            return
+        votes, self.pending_votes = self.pending_votes, {}
+        try:
+            await Database.write_votes(votes)
+        except Exception:
+            logger.exception(f"Could not write {len(votes)} poll votes, they will be retried")
+            # Votes cast while the write was running are newer than these, so they win.
+            votes.update(self.pending_votes)
+            self.pending_votes = votes
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        tally = self.tallies.get(payload.message_id)
+        if tally is None or payload.user_id == self.bot.user.id:
+            return
+        choice = str(payload.emoji)
+        if choice not in tally.emojis:
+            return
+
+        previous = tally.vote(payload.user_id, choice)
+        self.record_vote(tally, payload.user_id, choice)
+        if previous is not None:
+            # The user's reaction to their previous choice no longer counts, so it is removed to keep the poll honest.
+            # The removal event that follows is ignored, since the user's vote is no longer for that choice.
+            channel = self.bot.get_channel(payload.channel_id)
+            if channel is not None:
+                try:
+                    message = channel.get_partial_message(payload.message_id)
+                    await get_outbound_queue().remove_reaction(message, previous, discord.Object(id=payload.user_id))
+                except discord.HTTPException:
+                    pass
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        tally = self.tallies.get(payload.message_id)
+        if tally is None:
+            return
+        if tally.unvote(payload.user_id, str(payload.emoji)):
+            self.record_vote(tally, payload.user_id, None)
 
     @commands.command("poll")
     @commands.has_permissions(administrator=True)
@@ -58,7 +371,14 @@ class PollingCog(commands.Cog, name="Polls"):
 
         If channel is not specified, the poll will be posted in the current channel.
         If expiry_date is not specified, the poll will expire in 24 hours by default.
+        The expiry date can also be a date and time, like "2024-05-01 14:30", read in the time zone you set with .timezone.
         """
+        try:
+            parsed_date = parse_date_string(expiry_date or "1d", await get_user_timezone(ctx.author.id))
+        except DateParseError as e:
+            await ctx.send(f"Please correct the expiry date. {e}")
+            return
+
         await ctx.send(f"Creating poll: {title} - Please type the list of choices (comma-separated). Please also add an emoji per choice, so users can select a choice.")
 
         def check(msg: discord.Message):
@@ -71,9 +391,8 @@ class PollingCog(commands.Cog, name="Polls"):
         choices: List[str] = msg.content.split(',')
         parsed_choices = []
         for choice in choices:
-            emojis = [emote for emote in choice if emote in emoji.UNICODE_EMOJI['en']]
+            choice_text, emojis = parse_emojis(choice)
             if len(emojis) > 0:
-                choice_text = ''.join([c for c in choice.strip() if c not in emojis])
                 parsed_choices.append({"text": choice_text, "emoji": emojis[0]})
             else:
                 await ctx.send("Please add an emoji for the choice: " + choice)
@@ -83,33 +402,29 @@ class PollingCog(commands.Cog, name="Polls"):
             return
 
         nl = "\n" # Have to do this because using backslashes in f-strings isn't allowed in Python.
-        print(channel)
         description = f"""
 Available options:
 {nl.join([f"{i}) {choice['text']} {choice['emoji']}" for i, choice in enumerate(parsed_choices, start=1)])}
         """
         embed = discord.Embed(title=title, description=description, color=discord.Color.blue())
-        if channel:
-            message = await channel.send(embed=embed)
-        else:
-            message = await ctx.send(embed=embed)
-
-        for choice in parsed_choices:
-            await message.add_reaction(choice['emoji'])
-        
-        if expiry_date == None:
-            parsed_date = "1d"
-        else:
-            parsed_date = parse_date_string(expiry_date)
+        queue = get_outbound_queue()
+        message = await queue.send(channel or ctx.channel, embed=embed, priority=INTERACTIVE)
 
-        result = Database.create_poll(
+        poll = await Database.create_poll(
+            guild_id=ctx.guild.id,
+            channel_id=message.channel.id,
+            message_id=message.id,
             user_id=int(ctx.message.author.id),
             user=str(ctx.message.author),
             title=title,
             choices=parsed_choices,
             expiry_date=parsed_date
         )
-        print(result)
+        self.tallies[message.id] = PollTally(poll)
+        self.expiry_scheduler.schedule(message.id, parsed_date)
+
+        # The reactions are paced by the queue and still added in order, since they share a route.
+        await asyncio.gather(*[queue.add_reaction(message, choice['emoji'], priority=INTERACTIVE) for choice in parsed_choices])
 
 
     @create_poll.error
@@ -117,19 +432,49 @@ Available options:
         if isinstance(error, commands.errors.MissingRequiredArgument):
             await ctx.send(f"Please specify the poll title.")
         else:
-            print(error, ctx)
+            logger.error(f"Could not create a poll for {ctx.author}: {error}")
 
     @commands.command(name="polls")
     @commands.has_permissions(administrator=True)
     async def get_polls(self, ctx):
-        polls = Database.get_polls()
-        if polls:
-            description = '\n'.join([
-                f"\"{poll['title']}\" created by {poll['user']}, expires at {convert_date_to_readable_form(poll['expiry_date'])}" for i, poll in enumerate(polls, start=1)
-                ])
-            print(description)
-        embed = discord.Embed(title="Polls", description=description, color=discord.Color.blurple())
-        await ctx.send(embed=embed)
+        view = PaginatedView(
+            author_id=ctx.author.id,
+            title="Polls",
+            fetch_page=lambda after, limit: Database.get_polls_page(ctx.guild.id, after, limit),
+            key=lambda poll: poll["_id"],
+            render=lambda poll: f"\"{poll['title']}\" created by {poll['user']}, expires at {render_expiry_date(poll['expiry_date'])}",
+            empty_message="There are no polls in this server.",
+            color=discord.Color.blurple(),
+        )
+        await view.start(ctx)
+
+    @commands.command()
+    @commands.guild_only()
+    async def poll_results(self, ctx, poll: str):
+        """
+        Shows the results of a poll so far, or the final results of a poll that has closed.
+
+        Usage:
+        > .poll_results 1098765432109876543
+        > .poll_results https://discord.com/channels/.../1098765432109876543
+        Give the poll message's ID or link.
+        """
+        match = re.search(r"(\d+)/?$", poll.strip())
+        if match is None:
+            await ctx.send("Please give the poll message's ID or link.")
+            return
+        message_id = int(match.group(1))
+
+        tally = self.tallies.get(message_id)
+        final = tally is None
+        if final:
+            archived = await Database.get_archived_poll(message_id)
+            tally = PollTally.from_archive(archived) if archived else None
+        if tally is None or tally.guild_id != ctx.guild.id:
+            await ctx.send("Could not find a poll with that message ID or link.")
+            return
+        await ctx.send(embed=tally.results_embed(final=final))
 
 async def setup(client):
+    await Database.ensure_indexes()
     await client.add_cog(PollingCog(client))
@@ -0,0 +1,106 @@
+# Rules for reminders that repeat, like "every 2h" or "every weekday at 9am".
+from datetime import datetime, timedelta, tzinfo
+from typing import Optional
+from utils import DateParseError, get_timezone, parse_duration, parse_time_of_day
+import re
+
+
+# Anything more frequent would be spam.
+MIN_INTERVAL = timedelta(minutes=5)
+
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# Day masks, with bit 0 for Monday, the same numbering as datetime.weekday().
+EVERY_DAY = 0b1111111
+WEEKDAYS = 0b0011111
+WEEKENDS = 0b1100000
+_DAY_GROUPS = {"day": EVERY_DAY, "weekday": WEEKDAYS, "weekend": WEEKENDS}
+
+_RULE = re.compile(r"every\s+(?P<what>.+?)(?:\s+at\s+(?P<at>.+))?", re.IGNORECASE)
+
+
+def parse_rule(s: str, tz: Optional[tzinfo] = None) -> dict:
+    """
+    Parses a recurrence rule into the compact form it is stored in on the reminder. Only the rule is stored,
+    never a list of occurrences: the next one is worked out by next_occurrence() when the current one fires.
+
+    "every 2h" and other durations repeat at that interval: {"every": 7200}
+    "every day at 9am", "every weekday at 09:00", "every weekend at 10am", "every monday at 18:30" and
+    "every mon,wed,fri at 9am" repeat at a time of day in the time zone <tz>: {"days": 0b10101, "at": 540, "tz": "Europe/Berlin"}
+
+    Raises DateParseError if <s> isn't a rule.
+    """
+    match = _RULE.fullmatch(s.strip())
+    if match is None:
+        raise DateParseError(f"Could not understand \"{s}\". Repeating reminders look like \"every 2h\" or \"every weekday at 9am\".")
+
+    what = match.group("what").strip().lower()
+    days = _parse_days(what)
+    if days is None:
+        if match.group("at"):
+            raise DateParseError(f"\"{what}\" isn't a day of the week. Durations like \"every 2h\" don't take a time of day.")
+        interval = parse_duration(what)
+        if interval < MIN_INTERVAL:
+            raise DateParseError(f"Reminders can repeat at most every {MIN_INTERVAL.seconds // 60} minutes.")
+        return {"every": int(interval.total_seconds())}
+
+    if not match.group("at"):
+        raise DateParseError(f"Please say when on those days, like \"every {what} at 9am\".")
+    hour, minute = parse_time_of_day(match.group("at"))
+    return {"days": days, "at": hour * 60 + minute, "tz": getattr(tz, "key", None)}
+
+
+def _parse_days(what: str) -> Optional[int]:
+    # "weekdays" reads as naturally as "weekday".
+    if what.rstrip("s") in _DAY_GROUPS:
+        return _DAY_GROUPS[what.rstrip("s")]
+    mask = 0
+    for name in re.split(r"\s*(?:,|\band\b)\s*", what):
+        matches = [i for i, day in enumerate(DAY_NAMES) if len(name) >= 3 and day.startswith(name.rstrip("s"))]
+        if len(matches) != 1:
+            return None
+        mask |= 1 << matches[0]
+    return mask
+
+
+def next_occurrence(rule: dict, previous: datetime, now: datetime) -> datetime:
+    """
+    Returns the first occurrence of <rule> after both <previous>, the occurrence that just fired, and <now>.
+    Dates are naive datetimes in the bot's local time.
+
+    If the bot was down for a while, every occurrence it missed is skipped: the reminder fires once for all of them
+    and then carries on at the next occurrence that is still ahead, keeping to its original rhythm.
+    """
+    if "every" in rule:
+        interval = timedelta(seconds=rule["every"])
+        missed = max(0, (now - previous) // interval)
+        return previous + (missed + 1) * interval
+
+    tz = get_timezone(rule["tz"]) if rule.get("tz") else None
+    start = max(previous, now).astimezone(tz)
+    hour, minute = divmod(rule["at"], 60)
+    for days_ahead in range(8):
+        day = start + timedelta(days=days_ahead)
+        if not rule["days"] & (1 << day.weekday()):
+            continue
+        candidate = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate > start:
+            return candidate.astimezone().replace(tzinfo=None)
+    raise ValueError(f"Rule {rule} has no days")
+
+
+def describe_rule(rule: dict) -> str:
+    if "every" in rule:
+        parts = []
+        remaining = rule["every"]
+        for unit, seconds in (("w", 604800), ("d", 86400), ("h", 3600), ("m", 60), ("s", 1)):
+            if remaining >= seconds:
+                parts.append(f"{remaining // seconds}{unit}")
+                remaining %= seconds
+        return f"every {''.join(parts)}"
+
+    days = {EVERY_DAY: "day", WEEKDAYS: "weekday", WEEKENDS: "weekend"}.get(rule["days"])
+    if days is None:
+        days = ", ".join(DAY_NAMES[i].capitalize() for i in range(7) if rule["days"] & (1 << i))
+    hour, minute = divmod(rule["at"], 60)
+    zone = f" ({rule['tz']})" if rule.get("tz") else ""
+    return f"every {days} at {hour:02}:{minute:02}{zone}"
@@ -1,190 +1,448 @@
-from typing import List
-from discord.ext import commands
-from datetime import datetime, timedelta
-from pymongo import MongoClient
-from pymongo.cursor import Cursor
-from pymongo.database import Database as MongoDatabase
-from utils import parse_date_string, convert_date_to_readable_form
-import sqlite3
-import re
-import discord
-import calendar
-
-
-class Database:
-    "This class contains all the methods that involve interacting and working with the database. The bot commands simply call these methods to perform operations on the database."
-
-    @staticmethod
-    def create_connection() -> MongoDatabase:
-        client = MongoClient(host="localhost", port=27017)
-        bot_db = client.snuggly
-        return bot_db
-
-    @staticmethod
-    def check_reminders(user_id: int) -> List:
-        """
-        Retrieves the 'reminders' from the database which belong to the given user and returns them as a List object.
-        param <user_id>: An integer that contains the user's ID, which is like a very long number.
-        """
-        db = Database.create_connection()
-        reminders_col = db.reminders
-        c = reminders_col.find({"user_id": int(user_id)})
-        return c
-
-    @staticmethod
-    def _get_all_reminders() -> List:
-        db = Database.create_connection()
-        reminders_col = db.reminders
-        c = reminders_col.find()
-        return c
-
-    @staticmethod
-    def listen_for_due_reminders():
-        """
-        An asynchronous function that will check all reminders in the database for when one of them is due, 
-        and then alert the user.
-        
-        THIS FUNCTION IS INCOMPLETE AS OF YET!
-        """
-        # TODO: Finish this.
-        rows = Database._get_all_reminders()
-        for row in rows:
-            user = row[1]
-            reminder = row[2]
-            time = row[3]
-
-    @staticmethod
-    def add_reminder(user: str, user_id: int, reminder: str, time: str) -> int:
-        """
-        Adds a reminder to the database file.
-
-        param <user_id>: An integer that contains the user's ID, which is like a very long number.
-        param <user>: A string that contains the User's name and discord tag, for example Hassan#3557.
-        param <reminder>: A string that contains the reminder text, exactly as is stored in the database.
-        param <time>: A string that contains the time until we remind the user, for example '2d5h16m' is 2 days, 5 hours, and 16 minutes.
-        """
-        db = Database.create_connection()
-        reminders_col = db.reminders
-        result = reminders_col.insert_one({
-            "user_id": user_id,
-            "user": user,
-            "reminder": reminder,
-            "time": time
-        })
-
-        return result.acknowledged
-
-
-    @staticmethod
-    def remove_reminder(reminder: str, user_id: int):
-        """
-        Removes a reminder from the database file.
-
-        param <reminder>: A string that contains the reminder text, exactly as is stored in the database.
-        param <user_id>: An integer that contains the user's ID, which is like a very long number.
-        """
-        db = Database.create_connection()
-        reminders_col = db.reminders
-        result = reminders_col.delete_one({'reminder': reminder, 'user_id': user_id})
-        return result.acknowledged
-
-
-class RemindersCog(commands.Cog, name="Reminders"):
-    def __init__(self, bot) -> None:
-        self.bot = bot
-
-    @commands.command(aliases=["reminder"])
-    async def create_reminder(self, ctx, time, *, reminder):
-        """
-        Create a new reminder.
-
-        Usage:
-        > .create_reminder 1d6h "Do things"
-        This will remind you in 1 day and 6 hours.
-        """
-
-        try:
-            reminder_date = parse_date_string(time)
-        except Exception as e:
-            await ctx.send(
-                embed=discord.Embed(
-                    description=f"You have provided an invalid date and time. Please try again. The actual error is reproduced below:\n\n\{e}"
-                )
-            )
-
-        # We convert the reminder_date into a more readable form, which will be given to the user.
-        reminder_date_in_readable_form = convert_date_to_readable_form(
-            reminder_date
-        )
-
-        Database.add_reminder(
-            user=str(ctx.message.author),
-            user_id=int(ctx.message.author.id),
-            reminder=reminder,
-            time=reminder_date,
-        )
-
-        embed = discord.Embed(
-            description=f'Created reminder *"{reminder}"* due on **{reminder_date_in_readable_form}**'
-        )
-        await ctx.send(embed=embed)
-
-    @create_reminder.error
-    async def create_reminder_error(self, ctx, error):
-        if isinstance(error, commands.errors.MissingRequiredArgument):
-            embed = discord.Embed(title="Error", description=f"Please specify the: {error.param}", color=discord.Color.red())
-            await ctx.send(embed=embed)
-
-
-    @commands.command(aliases=["reminders"])
-    async def read_reminders(self, ctx):
-        """
-        Check all reminders you currently have.
-        """
-        rows = Database.check_reminders(user_id=ctx.message.author.id)
-        items = []
-
-        if rows:
-            for row in rows:
-                date_str = convert_date_to_readable_form(row['time'])
-                items.append(f"{row['reminder'].capitalize()} due at **{date_str}**")
-            embed = discord.Embed(
-                description=f"**Reminders for {ctx.message.author.mention}**\n\n"
-                + "\n".join(items), color=discord.Color.blue()
-            )
-            await ctx.send(embed=embed)
-        else:
-            await ctx.send(
-                embed=discord.Embed(
-                    description=f"No reminders for {ctx.message.author.mention}."
-                )
-            )
-
-
-    @commands.command(aliases=["rm-reminder"])
-    async def remove_reminder(self, ctx, reminder):
-        """
-        This command is incomplete and under construction!
-        """
-        pass
-
-    @staticmethod
-    async def check_for_due_reminders():
-        rows = Database._get_all_reminders()
-        due_reminders = []
-        if rows:
-            for row in rows:
-                date_str = row[4]
-                if date_str <= datetime.now():
-                    due_reminders.append(row)
-            return due_reminders
-        else:
-            return None
-
-    @staticmethod
-    async def remove_due_reminders(reminder: List):
-        Database.remove_reminder(reminder=reminder[3], user_id=reminder[2])
-
-
-async def setup(client):
-    await client.add_cog(RemindersCog(client))
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import defaultdict
+from discord.ext import commands
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.database import Database as MongoDatabase
+from database import create_indexes, get_database, run
+from metrics import timed_methods
+from outbound import NORMAL, get_outbound_queue
+from pagination import PaginatedView
+from recurrence import describe_rule, next_occurrence, parse_rule
+from scheduler import DeadlineScheduler
+from utils import DateParseError, parse_date_string, convert_date_to_readable_form
+from user_settings import get_user_timezone
+import asyncio
+import discord
+import functools
+import logging
+import os
+
+
+logger = logging.getLogger('snuggly')
+
+# Due reminders are claimed and delivered this many at a time.
+DELIVERY_BATCH_SIZE = 20000
+# Reminders for the same channel or user are sent together, up to this many in one message.
+REMINDERS_PER_MESSAGE = 20
+# Discord allows 4096 characters in an embed description.
+MAX_DESCRIPTION_LENGTH = 4000
+# A claimed reminder that hasn't been removed or rescheduled after this long is taken over by any process, because the
+# process that claimed it has stopped. It must be longer than delivering one batch can take.
+CLAIM_LEASE = timedelta(seconds=int(os.environ.get("REMINDER_CLAIM_LEASE_SECONDS", 600)))
+# Reminders whose message couldn't be sent, e.g. because Discord answered with a server error, are tried again after this long.
+DELIVERY_RETRY_DELAY = timedelta(seconds=60)
+
+# ("channel", channel_id) or ("user", user_id)
+Destination = Tuple[str, int]
+
+
+@timed_methods
+class Database:
+    "This class contains all the methods that involve interacting and working with the database. The bot commands simply call these methods to perform operations on the database."
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def ensure_indexes():
+        db = Database.create_connection()
+        await create_indexes(db.reminders, [
+            # Serves remove_reminder.
+            IndexModel([("user_id", ASCENDING), ("reminder", ASCENDING)], name="user_id_reminder"),
+            # Serves the paginated listing in read_reminders.
+            IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id__id"),
+            # Serves the pending-reminder load at startup and any sweep for due reminders.
+            IndexModel([("time", ASCENDING)], name="time"),
+            # Reads back the reminders claimed by one delivery batch. Only reminders being delivered have the field.
+            IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+        ])
+
+    @staticmethod
+    async def get_reminders_page(user_id: int, after: Optional[ObjectId], limit: int) -> List[dict]:
+        """
+        Retrieves up to <limit> of the given user's reminders, oldest first, starting after the reminder with the ID <after>.
+        param <user_id>: An integer that contains the user's ID, which is like a very long number.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        query = {"user_id": int(user_id)}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        c = await run(lambda: list(
+            reminders_col.find(query, {"reminder": 1, "time": 1, "repeat": 1}).sort("_id", ASCENDING).limit(limit)
+        ))
+        return c
+
+    @staticmethod
+    async def get_pending_reminders() -> List[dict]:
+        """
+        Retrieves the ID, due time and claim time of every reminder. Only these fields are fetched, because they are
+        all the scheduler needs. Reminders that are being delivered are included, so they can be taken over if the
+        process delivering them stops before it is done.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        c = await run(lambda: list(reminders_col.find({}, {"time": 1, "claimed_at": 1})))
+        return c
+
+    @staticmethod
+    async def get_deadlines(reminder_ids: List[ObjectId]) -> List[dict]:
+        "Retrieves the due time and claim time of the given reminders, leaving out those that have been removed."
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        return await run(lambda: list(reminders_col.find({"_id": {"$in": reminder_ids}}, {"time": 1, "claimed_at": 1})))
+
+    @staticmethod
+    async def claim_reminders(reminder_ids: List[ObjectId]) -> List[dict]:
+        """
+        Marks due reminders as being delivered and returns them. Reminders that aren't due, have been removed, or are
+        claimed by a delivery that started less than CLAIM_LEASE ago are left out, which is what stops two processes from
+        delivering the same reminder at once. A claim older than that belongs to a process that stopped halfway, and is taken over.
+
+        The claim is one update_many that stamps the reminders with a token unique to this call, and the claimed
+        reminders are then read back by that token: two queries, however many reminders there are.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        token = ObjectId()
+        now = datetime.now()
+        await run(
+            reminders_col.update_many,
+            {
+                "_id": {"$in": reminder_ids},
+                "time": {"$lte": now},
+                "$or": [{"claimed_at": {"$exists": False}}, {"claimed_at": {"$lt": now - CLAIM_LEASE}}],
+            },
+            {"$set": {"claimed_at": now, "claim": token}},
+        )
+        return await run(lambda: list(reminders_col.find({"claim": token})))
+
+    @staticmethod
+    async def reschedule_reminders(times: Dict[ObjectId, datetime]):
+        """
+        Moves claimed repeating reminders on to their next occurrence and releases their claims. Each reminder is moved
+        with one atomic update of its own document, so it keeps its ID, and all of them are sent in one bulk write.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        await run(reminders_col.bulk_write, [
+            UpdateOne({"_id": reminder_id}, {"$set": {"time": time}, "$unset": {"claimed_at": "", "claim": ""}})
+            for reminder_id, time in times.items()
+        ], ordered=False)
+
+    @staticmethod
+    async def release_claims(reminder_ids: List[ObjectId]):
+        "Releases the claims on reminders that couldn't be delivered, so any process can deliver them again."
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        await run(reminders_col.update_many, {"_id": {"$in": reminder_ids}}, {"$unset": {"claimed_at": "", "claim": ""}})
+
+    @staticmethod
+    async def add_reminder(user: str, user_id: int, reminder: str, time: datetime, channel_id: int = None,
+                           repeat: dict = None) -> ObjectId:
+        """
+        Adds a reminder to the database file and returns its ID.
+
+        param <user_id>: An integer that contains the user's ID, which is like a very long number.
+        param <user>: A string that contains the User's name and discord tag, for example Hassan#3557.
+        param <reminder>: A string that contains the reminder text, exactly as is stored in the database.
+        param <time>: A datetime object that contains the date and time when we remind the user.
+        param <channel_id>: The ID of the channel the reminder is posted in. If it is None, the user gets a DM instead.
+        param <repeat>: The recurrence rule of a repeating reminder, from recurrence.parse_rule(). <time> is its first occurrence.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        document = {
+            "user_id": user_id,
+            "user": user,
+            "reminder": reminder,
+            "time": time,
+            "channel_id": channel_id,
+        }
+        if repeat is not None:
+            document["repeat"] = repeat
+        result = await run(reminders_col.insert_one, document)
+
+        return result.inserted_id
+
+
+    @staticmethod
+    async def remove_reminder(reminder: str, user_id: int) -> Optional[dict]:
+        """
+        Removes a reminder from the database file and returns it, or None if there was no such reminder.
+
+        param <reminder>: A string that contains the reminder text, exactly as is stored in the database.
+        param <user_id>: An integer that contains the user's ID, which is like a very long number.
+        """
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        result = await run(reminders_col.find_one_and_delete, {'reminder': reminder, 'user_id': user_id})
+        return result
+
+    @staticmethod
+    async def delete_reminders(reminder_ids: List[ObjectId]) -> int:
+        db = Database.create_connection()
+        reminders_col = db.reminders
+        result = await run(reminders_col.delete_many, {"_id": {"$in": reminder_ids}})
+        return result.deleted_count
+
+
+def claim_deadline(reminder: dict) -> datetime:
+    "Returns when a reminder should next be looked at: when it is due, or when the lease of its claim runs out."
+    if "claimed_at" in reminder:
+        return max(reminder["time"], reminder["claimed_at"] + CLAIM_LEASE)
+    return reminder["time"]
+
+
+def chunk_reminders(reminders: List[dict]) -> Iterator[List[dict]]:
+    "Splits <reminders> into groups small enough to be sent in one message."
+    chunk, length = [], 0
+    for reminder in reminders:
+        # Room for the mention and the repeat rule as well as the text.
+        line_length = len(reminder["reminder"]) + 120
+        if chunk and (len(chunk) >= REMINDERS_PER_MESSAGE or length + line_length > MAX_DESCRIPTION_LENGTH):
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(reminder)
+        length += line_length
+    if chunk:
+        yield chunk
+
+
+class RemindersCog(commands.Cog, name="Reminders"):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.scheduler = DeadlineScheduler(self.deliver_reminders, name="reminders")
+
+    async def cog_load(self):
+        # The pending reminders are loaded once. From here on, the scheduler is kept up to date by the commands below.
+        reminders = await Database.get_pending_reminders()
+        self.scheduler.schedule_many((reminder["_id"], claim_deadline(reminder)) for reminder in reminders)
+        self.scheduler.start()
+        logger.info(f"Scheduled {len(self.scheduler)} pending reminders")
+
+    async def cog_unload(self):
+        await self.scheduler.stop()
+
+    async def deliver_reminders(self, reminder_ids: List[ObjectId]):
+        await self.bot.wait_until_ready()
+        for start in range(0, len(reminder_ids), DELIVERY_BATCH_SIZE):
+            await self.deliver_batch(reminder_ids[start:start + DELIVERY_BATCH_SIZE])
+
+    async def deliver_batch(self, reminder_ids: List[ObjectId]):
+        """
+        Delivers due reminders. Reminders for the same channel, or the same user's DMs, are sent together in as few
+        messages as possible, and the messages go through the outbound queue, which keeps to Discord's per-channel
+        rate limits and lets replies to commands go first.
+
+        Every reminder is delivered at least once. A claimed reminder is only removed, or moved on to its next
+        occurrence, once its message has been sent. If the bot stops in between, the claim's lease runs out and the
+        reminder is sent again, by this process after a restart or by any other one that is running. If a message
+        can't be sent, the claims on its reminders are released and they are tried again after DELIVERY_RETRY_DELAY,
+        unless Discord refused it for good (Forbidden or NotFound), in which case they are handled as if sent.
+        """
+        reminders = await Database.claim_reminders(reminder_ids)
+        claimed = {reminder["_id"] for reminder in reminders}
+        missed = [reminder_id for reminder_id in reminder_ids if reminder_id not in claimed]
+        if missed:
+            # These are being delivered by another process, or were moved on by it. They are looked at again once
+            # that delivery's lease runs out, in case the other process stops before it is done.
+            for reminder in await Database.get_deadlines(missed):
+                self.scheduler.schedule(reminder["_id"], claim_deadline(reminder))
+        if not reminders:
+            return
+
+        queue = get_outbound_queue()
+        groups = self.group_by_destination(reminders)
+        targets = await asyncio.gather(*[self.resolve_destination(destination) for destination in groups], return_exceptions=True)
+        chunks, deliveries = [], []
+        for ((kind, _), group), target in zip(groups.items(), targets):
+            for chunk in chunk_reminders(group):
+                chunks.append(chunk)
+                if isinstance(target, BaseException):
+                    failure = asyncio.get_running_loop().create_future()
+                    failure.set_exception(target)
+                    deliveries.append(failure)
+                    continue
+                # The route is the channel the message goes to, the same one every other cog's sends to it use.
+                send = functools.partial(self.send_reminders, target, kind, chunk)
+                deliveries.append(queue.submit(("send", target.id), send, priority=NORMAL))
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+
+        delivered, failed, errors = [], [], []
+        for chunk, result in zip(chunks, results):
+            if not isinstance(result, BaseException):
+                delivered.extend(chunk)
+            elif isinstance(result, (discord.Forbidden, discord.NotFound)):
+                # The channel or user can't be reached at all, so trying again would only fail again.
+                logger.warning(f"Dropping {len(chunk)} reminders that can't be delivered: {result}")
+                delivered.extend(chunk)
+            else:
+                failed.extend(chunk)
+                errors.append(result)
+
+        one_off = [reminder["_id"] for reminder in delivered if "repeat" not in reminder]
+        if one_off:
+            await Database.delete_reminders(one_off)
+
+        # Only the next occurrence is ever stored. Occurrences missed while the bot was down are skipped,
+        # so this one delivery stands in for all of them.
+        now = datetime.now()
+        next_times = {
+            reminder["_id"]: next_occurrence(reminder["repeat"], reminder["time"], now)
+            for reminder in delivered if "repeat" in reminder
+        }
+        if next_times:
+            await Database.reschedule_reminders(next_times)
+            for reminder_id, next_time in next_times.items():
+                self.scheduler.schedule(reminder_id, next_time)
+
+        if failed:
+            logger.error(f"Could not deliver {len(failed)} reminders, trying again in {DELIVERY_RETRY_DELAY}", exc_info=errors[0])
+            await Database.release_claims([reminder["_id"] for reminder in failed])
+            retry_at = now + DELIVERY_RETRY_DELAY
+            for reminder in failed:
+                self.scheduler.schedule(reminder["_id"], retry_at)
+
+    def group_by_destination(self, reminders: List[dict]) -> Dict[Destination, List[dict]]:
+        # Reminders whose channel the bot can't see anymore go to the user's DMs instead.
+        groups = defaultdict(list)
+        for reminder in reminders:
+            channel_id = reminder.get("channel_id")
+            if channel_id and self.bot.get_channel(channel_id) is not None:
+                groups[("channel", channel_id)].append(reminder)
+            else:
+                groups[("user", reminder["user_id"])].append(reminder)
+        return groups
+
+    async def resolve_destination(self, destination: Destination) -> discord.abc.Messageable:
+        "Returns the channel to send to <destination>: the channel itself, or the user's DM channel."
+        kind, target_id = destination
+        if kind == "channel":
+            return self.bot.get_channel(target_id)
+        user = self.bot.get_user(target_id) or await self.bot.fetch_user(target_id)
+        return user.dm_channel or await user.create_dm()
+
+    async def send_reminders(self, target: discord.abc.Messageable, kind: str, reminders: List[dict]):
+        mentions = " ".join(dict.fromkeys(f"<@{reminder['user_id']}>" for reminder in reminders))
+        if len(reminders) == 1:
+            reminder = reminders[0]
+            embed = discord.Embed(description=f"**Reminder:** {reminder['reminder']}", color=discord.Color.blue())
+            if "repeat" in reminder:
+                embed.set_footer(text=f"Repeats {describe_rule(reminder['repeat'])}. Stop it with .remove_reminder {reminder['reminder']}")
+        else:
+            lines = [
+                (f"<@{reminder['user_id']}>: " if kind == "channel" else "") + reminder["reminder"]
+                + (f" *(repeats {describe_rule(reminder['repeat'])})*" if "repeat" in reminder else "")
+                for reminder in reminders
+            ]
+            embed = discord.Embed(title="Reminders", description="\n".join(lines), color=discord.Color.blue())
+        await target.send(content=mentions, embed=embed)
+
+    @commands.command(aliases=["reminder"])
+    async def create_reminder(self, ctx, time, *, reminder):
+        """
+        Create a new reminder.
+
+        Usage:
+        > .create_reminder 1d6h "Do things"
+        This will remind you in 1 day and 6 hours. Durations can use w, d, h, m and s.
+        > .create_reminder "2024-05-01 14:30" "Do things"
+        > .create_reminder 2:30pm "Do things"
+        Dates and times are read in the time zone you set with the .timezone command.
+        > .create_reminder "every 2h" "Drink water"
+        > .create_reminder "every weekday at 9am" "Stand-up"
+        > .create_reminder "every mon,wed,fri at 18:30" "Gym"
+        Repeating reminders carry on until you remove them.
+        """
+        timezone = await get_user_timezone(ctx.author.id)
+        repeat = None
+        try:
+            if time.lower().startswith("every "):
+                repeat = parse_rule(time, timezone)
+                now = datetime.now()
+                reminder_date = next_occurrence(repeat, now, now)
+            else:
+                reminder_date = parse_date_string(time, timezone)
+        except DateParseError as e:
+            await ctx.send(
+                embed=discord.Embed(
+                    description=f"You have provided an invalid date and time. Please try again.\n\n{e}"
+                )
+            )
+            return
+
+        # We convert the reminder_date into a more readable form, which will be given to the user.
+        reminder_date_in_readable_form = convert_date_to_readable_form(
+            reminder_date, timezone
+        )
+
+        reminder_id = await Database.add_reminder(
+            user=str(ctx.message.author),
+            user_id=int(ctx.message.author.id),
+            reminder=reminder,
+            time=reminder_date,
+            channel_id=ctx.channel.id,
+            repeat=repeat,
+        )
+        self.scheduler.schedule(reminder_id, reminder_date)
+
+        repeats = f", repeating {describe_rule(repeat)}" if repeat else ""
+        embed = discord.Embed(
+            description=f'Created reminder *"{reminder}"* due on **{reminder_date_in_readable_form}**{repeats}'
+        )
+        await ctx.send(embed=embed)
+
+    @create_reminder.error
+    async def create_reminder_error(self, ctx, error):
+        if isinstance(error, commands.errors.MissingRequiredArgument):
+            embed = discord.Embed(title="Error", description=f"Please specify the: {error.param}", color=discord.Color.red())
+            await ctx.send(embed=embed)
+
+
+    @commands.command(aliases=["reminders"])
+    async def read_reminders(self, ctx):
+        """
+        Check all reminders you currently have.
+        """
+        user_id = int(ctx.message.author.id)
+        timezone = await get_user_timezone(user_id)
+        view = PaginatedView(
+            author_id=user_id,
+            title=f"Reminders for {ctx.message.author}",
+            fetch_page=lambda after, limit: Database.get_reminders_page(user_id, after, limit),
+            key=lambda row: row["_id"],
+            render=lambda row: f"{row['reminder'].capitalize()} due at **{convert_date_to_readable_form(row['time'], timezone)}**"
+                               + (f", repeats {describe_rule(row['repeat'])}" if "repeat" in row else ""),
+            empty_message=f"No reminders for {ctx.message.author.mention}.",
+        )
+        await view.start(ctx)
+
+
+    @commands.command(aliases=["rm-reminder"])
+    async def remove_reminder(self, ctx, *, reminder):
+        """
+        Remove one of your reminders.
+
+        Usage:
+        > .remove_reminder Do things
+        """
+        removed = await Database.remove_reminder(reminder=reminder, user_id=int(ctx.message.author.id))
+        if removed is None:
+            await ctx.send(
+                embed=discord.Embed(
+                    description="The reminder you entered does not match any existing reminder. Please try again."
+                )
+            )
+            return
+
+        self.scheduler.cancel(removed["_id"])
+        await ctx.send(embed=discord.Embed(description=f'Removed reminder *"{removed["reminder"]}"*'))
+
+
+async def setup(client):
+    await Database.ensure_indexes()
+    await client.add_cog(RemindersCog(client))
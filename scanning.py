@@ -0,0 +1,202 @@
+# Scans the message history of a whole server, several channels at a time.
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from pymongo.database import Database as MongoDatabase
+from database import get_database, run
+from metrics import timed_methods
+from outbound import get_outbound_queue
+import asyncio
+import discord
+import logging
+import os
+import time
+
+
+logger = logging.getLogger('snuggly')
+
+# How many channels are scanned at once. Every channel has its own rate-limit bucket for reading history,
+# but all of them share the bot's global limit, so this is kept small.
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", 5))
+# Messages are handed to the handler in batches of this size, which is also the size of one history request.
+BATCH_SIZE = 100
+# Seconds between edits of the status message.
+STATUS_INTERVAL = 5
+# A checkpoint that hasn't been updated for this long is discarded, and the scan starts over. The messages it
+# covered may have changed too much since for resuming from it to make sense.
+CHECKPOINT_TTL = timedelta(hours=int(os.environ.get("SCAN_CHECKPOINT_TTL_HOURS", 24)))
+
+# Called with a channel and a batch of its messages. Returns how many of them matched.
+BatchHandler = Callable[[discord.TextChannel, List[discord.Message]], Awaitable[int]]
+
+
+@timed_methods
+class Database:
+    """
+    Stores scan checkpoints. For every channel, a checkpoint records the oldest message that has been handled
+    (before) and the newest one (after), so an interrupted scan carries on from both ends the next time the same
+    command is run.
+    """
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def get_checkpoint(scan_id: str) -> Optional[dict]:
+        "Returns the checkpoint of <scan_id>, unless it is older than CHECKPOINT_TTL, in which case it is removed."
+        db = Database.create_connection()
+        await run(db.scan_checkpoints.delete_one, {"_id": scan_id, "updated_at": {"$lt": datetime.now() - CHECKPOINT_TTL}})
+        return await run(db.scan_checkpoints.find_one, {"_id": scan_id})
+
+    @staticmethod
+    async def save_channel_checkpoint(scan_id: str, channel_id: int, before: Optional[int], after: Optional[int], done: bool):
+        db = Database.create_connection()
+        position = {"before": before, "after": after, "done": done}
+        await run(
+            db.scan_checkpoints.update_one,
+            {"_id": scan_id},
+            {"$set": {f"channels.{channel_id}": position, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+
+    @staticmethod
+    async def remove_checkpoint(scan_id: str):
+        db = Database.create_connection()
+        await run(db.scan_checkpoints.delete_one, {"_id": scan_id})
+
+
+async def _batches(history: AsyncIterator[discord.Message]) -> AsyncIterator[List[discord.Message]]:
+    batch: List[discord.Message] = []
+    async for message in history:
+        batch.append(message)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ignore_edit_error(edit: asyncio.Future):
+    # A status message that can't be edited, e.g. because it was deleted, doesn't stop the scan.
+    if not edit.cancelled():
+        edit.exception()
+
+
+@dataclass
+class ScanProgress:
+    channels: int = 0
+    channels_done: int = 0
+    messages: int = 0
+    matches: int = 0
+
+    def describe(self) -> str:
+        return f"{self.channels_done}/{self.channels} channels, {self.messages:,} messages scanned, {self.matches:,} matches"
+
+
+class GuildScan:
+    """
+    Runs <handler> over the message history of every text channel in <guild>, newest messages first.
+
+    Up to <concurrency> channels are scanned at once, and all of a channel's history is read. Each channel's position
+    is saved after every batch under <name>, so if the bot stops halfway the next scan with the same name resumes
+    where this one left off: it reads what is older than the oldest message handled, and what was sent after the
+    newest, including in channels that were done. The checkpoint is removed once every channel is done.
+
+    If <status> is given, it is edited every few seconds with the scan's progress. A scan that isn't <resumable>,
+    because its results only live in memory, neither reads nor saves checkpoints.
+
+    Usage:
+    > scan = GuildScan(ctx.guild, "remove_urls", handler, status=await ctx.send("Scanning..."))
+    > progress = await scan.run()
+    """
+
+    def __init__(self, guild: discord.Guild, name: str, handler: BatchHandler, status: discord.Message = None,
+                 concurrency: int = SCAN_CONCURRENCY, resumable: bool = True) -> None:
+        self.guild = guild
+        self.scan_id = f"{guild.id}:{name}"
+        self.handler = handler
+        self.status = status
+        self.concurrency = concurrency
+        self.resumable = resumable
+        self.progress = ScanProgress()
+        self._last_status = 0.0
+
+    async def run(self) -> ScanProgress:
+        checkpoint = await Database.get_checkpoint(self.scan_id) if self.resumable else None
+        positions: Dict[str, dict] = checkpoint["channels"] if checkpoint else {}
+        if checkpoint:
+            logger.info(f"Resuming scan {self.scan_id} from its checkpoint")
+
+        channels = [channel for channel in self.guild.channels if isinstance(channel, discord.TextChannel)]
+        self.progress.channels = len(channels)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def scan(channel: discord.TextChannel):
+            async with semaphore:
+                await self.scan_channel(channel, positions.get(str(channel.id), {}))
+            self.progress.channels_done += 1
+            await self.report()
+
+        tasks = [asyncio.create_task(scan(channel)) for channel in channels]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One channel failing stops the whole scan. Its checkpoint lets the next run pick up from here.
+            for task in tasks:
+                task.cancel()
+            raise
+        if self.resumable:
+            await Database.remove_checkpoint(self.scan_id)
+        await self.report(force=True)
+        return self.progress
+
+    async def scan_channel(self, channel: discord.TextChannel, position: dict):
+        before, after, done = position.get("before"), position.get("after"), position.get("done", False)
+        try:
+            if after is not None:
+                # Messages sent since the interrupted scan started are read oldest first, so <after> can move forward.
+                history = channel.history(limit=None, after=discord.Object(id=after), oldest_first=True)
+                async for batch in _batches(history):
+                    await self.handle_batch(channel, batch)
+                    after = batch[-1].id
+                    await self.save_position(channel, before, after, done)
+            if not done:
+                history = channel.history(
+                    limit=None, before=discord.Object(id=before) if before else None, oldest_first=False
+                )
+                async for batch in _batches(history):
+                    if after is None and before is None:
+                        # The first message read was the newest when the scan started. Later ones are left for a resumed scan.
+                        after = batch[0].id
+                    await self.handle_batch(channel, batch)
+                    # The history is read newest first, so the last message of the batch is the oldest handled so far.
+                    before = batch[-1].id
+                    await self.save_position(channel, before, after, done)
+        except discord.Forbidden:
+            logger.info(f"Skipping #{channel.name}, which the bot isn't allowed to read")
+        # A channel that had no messages yet is read from its start if the scan is resumed.
+        await self.save_position(channel, before, 0 if after is None else after, True)
+
+    async def save_position(self, channel: discord.TextChannel, before: Optional[int], after: Optional[int], done: bool):
+        if self.resumable:
+            await Database.save_channel_checkpoint(self.scan_id, channel.id, before, after, done)
+
+    async def handle_batch(self, channel: discord.TextChannel, batch: List[discord.Message]):
+        self.progress.matches += await self.handler(channel, batch)
+        self.progress.messages += len(batch)
+        await self.report()
+
+    async def report(self, force: bool = False):
+        if self.status is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_status < STATUS_INTERVAL:
+            return
+        self._last_status = now
+        prefix = "Scan finished" if force else "Scanning server contents"
+        # Progress edits aren't waited for. If one is still queued when the next comes, only the newer one is sent.
+        edit = get_outbound_queue().edit(self.status, content=f"{prefix}: {self.progress.describe()}")
+        edit.add_done_callback(_ignore_edit_error)
+        if force:
+            await asyncio.wait([edit])
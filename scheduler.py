@@ -0,0 +1,140 @@
+# A deadline scheduler shared by everything in the bot that has to happen at a given time.
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+
+
+logger = logging.getLogger('snuggly')
+
+# We never sleep longer than this in one go, so a change to the system clock can't delay a deadline by more than this.
+MAX_SLEEP_SECONDS = 300
+# Keys whose callback raised are tried again after this many seconds, doubling with every failure in a row up to
+# MAX_SLEEP_SECONDS.
+RETRY_SECONDS = 5
+
+
+class DeadlineScheduler:
+    """
+    Keeps a time-ordered min-heap of (deadline, key) entries and calls <callback> with the keys whose deadline
+    has passed. The scheduler sleeps until the earliest deadline instead of polling, so an idle scheduler costs
+    nothing no matter how many entries it holds.
+
+    schedule() is O(log n). cancel() is O(1): cancelled entries stay in the heap and are skipped when they reach
+    the top, and the heap is compacted once more than half of it is stale.
+
+    If <callback> raises, the keys it was called with are scheduled again after a backoff, unless the callback
+    already rescheduled them itself. The callback must therefore cope with being called again for the same key.
+
+    Usage:
+    > scheduler = DeadlineScheduler(deliver_reminders, name="reminders")
+    > scheduler.schedule(reminder_id, due_date)
+    > scheduler.start()
+    """
+
+    def __init__(self, callback: Callable[[List[Hashable]], Awaitable], name: str) -> None:
+        self.callback = callback
+        self.name = name
+        self._heap: List[Tuple[datetime, int, Hashable]] = []
+        # Maps every live key to the sequence number of its current heap entry. Any other entry for that key is stale.
+        self._live: Dict[Hashable, int] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._live
+
+    def schedule(self, key: Hashable, deadline: datetime):
+        "Schedules <key> to fire at <deadline>. Scheduling a key that is already pending moves it to the new deadline."
+        seq = next(self._counter)
+        self._live[key] = seq
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if self._heap[0][1] == seq:
+            # The new entry is now the earliest deadline, so the runner has to re-arm its timer.
+            self._wakeup.set()
+
+    def schedule_many(self, entries: Iterable[Tuple[Hashable, datetime]]):
+        "Bulk-loads (key, deadline) pairs in O(n), which is much cheaper than n schedule() calls at startup."
+        for key, deadline in entries:
+            seq = next(self._counter)
+            self._live[key] = seq
+            self._heap.append((deadline, seq, key))
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        if self._live.pop(key, None) is None:
+            return False
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._live):
+            self._compact()
+        return True
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._live.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+
+    def _discard_stale(self):
+        while self._heap and self._live.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[datetime]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[Hashable]:
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            del self._live[key]
+            due.append(key)
+            self._discard_stale()
+        return due
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            due = self.pop_due(datetime.now())
+            if due:
+                try:
+                    await self.callback(due)
+                except Exception:
+                    self._failures += 1
+                    delay = min(RETRY_SECONDS * 2 ** (self._failures - 1), MAX_SLEEP_SECONDS)
+                    logger.exception(f"The {self.name} scheduler failed to handle {len(due)} due entries, retrying in {delay}s")
+                    retry_at = datetime.now() + timedelta(seconds=delay)
+                    for key in due:
+                        if key not in self._live:
+                            self.schedule(key, retry_at)
+                else:
+                    self._failures = 0
+                continue
+
+            deadline = self.next_deadline()
+            timeout = MAX_SLEEP_SECONDS
+            if deadline is not None:
+                timeout = min(timeout, max(0.0, (deadline - datetime.now()).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
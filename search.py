@@ -0,0 +1,97 @@
+# Full-text search over a user's notes.
+from collections import Counter
+from typing import Dict, List, Tuple
+import heapq
+import math
+import re
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Words in a note's title count this many times as much as words in its content.
+TITLE_WEIGHT = 3
+
+# BM25 tuning constants. These are the usual defaults.
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class InvertedIndex:
+    """
+    An inverted index over one user's notes. Every token maps to the notes it appears in and how often, so a
+    query only touches the notes that contain its words. Notes are added and removed one at a time as they are
+    written and deleted, and results are ranked with BM25.
+
+    Usage:
+    > index = InvertedIndex()
+    > index.add("Groceries", "milk, eggs and bread")
+    > index.search("eggs")
+    [('Groceries', 0.28...)]
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        # The distinct tokens of every note, so a note can be removed without visiting the whole vocabulary.
+        self.doc_tokens: Dict[str, Tuple[str, ...]] = {}
+        self.total_length = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, title: str, content: str):
+        if title in self.doc_lengths:
+            self.remove(title)
+
+        counts = Counter(tokenize(content))
+        for token in tokenize(title):
+            counts[token] += TITLE_WEIGHT
+
+        length = sum(counts.values())
+        self.doc_lengths[title] = length
+        self.doc_tokens[title] = tuple(counts)
+        self.total_length += length
+        for token, count in counts.items():
+            self.postings.setdefault(token, {})[title] = count
+        # A rough estimate of the bytes this note takes up in the index, used to bound the cache of indexes.
+        self.size += 100 * len(counts) + len(title) + 64
+
+    def remove(self, title: str):
+        length = self.doc_lengths.pop(title, None)
+        if length is None:
+            return
+
+        self.total_length -= length
+        tokens = self.doc_tokens.pop(title)
+        for token in tokens:
+            docs = self.postings[token]
+            del docs[title]
+            if not docs:
+                del self.postings[token]
+        self.size -= 100 * len(tokens) + len(title) + 64
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Returns up to <limit> (title, score) pairs for the notes that match any word of <query>, best match first.
+        """
+        if not self.doc_lengths:
+            return []
+
+        n = len(self.doc_lengths)
+        average_length = self.total_length / n
+        scores: Dict[str, float] = {}
+        for token in set(tokenize(query)):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for title, count in docs.items():
+                norm = K1 * (1 - B + B * self.doc_lengths[title] / average_length)
+                scores[title] = scores.get(title, 0.0) + idf * count * (K1 + 1) / (count + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
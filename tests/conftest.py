@@ -0,0 +1,18 @@
+# The cogs are top-level modules in the repository root, which pytest doesn't put on the path when run as "pytest".
+from unittest import mock
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo():
+    "Points the cogs at an in-memory mongomock database. Tests that use it are skipped if mongomock isn't installed."
+    mongomock = pytest.importorskip("mongomock")
+    import database
+
+    with mock.patch.object(database, "_client", mongomock.MongoClient()):
+        yield database.get_database()
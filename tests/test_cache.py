@@ -0,0 +1,79 @@
+from unittest import mock
+
+import cache
+from cache import LRUCache, MISSING
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = LRUCache(max_entries=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+
+    assert lru.get("b") is MISSING
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert lru.evictions == 1
+
+
+def test_byte_limit_evicts_and_skips_oversized_values():
+    lru = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+    lru.set("a", "xxxxxx")
+    lru.set("b", "xxxxxx")
+    assert lru.peek("a") is MISSING
+    assert lru.bytes == 6
+
+    lru.set("b", "x" * 11)
+    assert lru.peek("b") is MISSING
+    assert lru.bytes == 0
+
+
+def test_expired_entries_are_misses():
+    lru = LRUCache(ttl=10)
+    with mock.patch.object(cache.time, "monotonic", return_value=100.0):
+        lru.set("a", 1)
+    with mock.patch.object(cache.time, "monotonic", return_value=110.0):
+        assert lru.get("a") is MISSING
+    assert lru.expirations == 1
+    assert len(lru) == 0
+
+
+def test_fill_caches_the_value_read():
+    lru = LRUCache()
+    token = lru.begin_fill("a")
+    assert lru.fill("a", token, 1)
+    assert lru.get("a") == 1
+
+
+def test_fill_is_dropped_after_a_write_during_the_read():
+    lru = LRUCache()
+    token = lru.begin_fill("a")
+    lru.set("a", "new")
+    assert not lru.fill("a", token, "old")
+    assert lru.get("a") == "new"
+
+
+def test_fill_is_dropped_after_an_invalidation_during_the_read():
+    lru = LRUCache()
+    token = lru.begin_fill("a")
+    lru.invalidate("a")
+    assert not lru.fill("a", token, "old")
+    assert lru.get("a") is MISSING
+
+
+def test_only_the_newest_of_overlapping_fills_is_cached():
+    lru = LRUCache()
+    first = lru.begin_fill("a")
+    second = lru.begin_fill("a")
+    assert not lru.fill("a", first, "older read")
+    assert lru.fill("a", second, "newer read")
+    assert lru.get("a") == "newer read"
+
+
+def test_fills_that_never_finish_are_bounded():
+    lru = LRUCache(max_entries=3)
+    tokens = {key: lru.begin_fill(key) for key in "abcd"}
+    assert len(lru._fills) == 3
+    assert not lru.fill("a", tokens["a"], 1)
+    assert lru.fill("d", tokens["d"], 4)
@@ -0,0 +1,26 @@
+import pytest
+
+from emoji_parser import parse_emojis
+
+
+@pytest.mark.parametrize("text, rest, emojis", [
+    ("Pizza 🍕", "Pizza", ["🍕"]),
+    ("🍕 Pizza", "Pizza", ["🍕"]),
+    ("Pizza", "Pizza", []),
+    ("", "", []),
+    # A skin tone belongs to the emoji before it.
+    ("Yes 👍🏽", "Yes", ["👍🏽"]),
+    # So do the parts of a ZWJ sequence and of a flag.
+    ("Family 👨‍👩‍👧", "Family", ["👨‍👩‍👧"]),
+    ("Germany 🇩🇪", "Germany", ["🇩🇪"]),
+    # The fully-qualified form, with its variation selector, is one emoji.
+    ("Heart ❤️", "Heart", ["❤️"]),
+    ("Two 🍕🍔", "Two", ["🍕", "🍔"]),
+    ("Custom <:party:123456789012345678>", "Custom", ["<:party:123456789012345678>"]),
+    ("Animated <a:party:123456789012345678>", "Animated", ["<a:party:123456789012345678>"]),
+    ("Not <:x:1> emoji", "Not <:x:1> emoji", []),
+])
+def test_parse_emojis(text, rest, emojis):
+    parsed = parse_emojis(text)
+    assert parsed.text == rest
+    assert parsed.emojis == emojis
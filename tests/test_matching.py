@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from matching import AhoCorasick, MessageMatcher
+
+
+def test_find_all_is_case_insensitive():
+    automaton = AhoCorasick(["spam", "Example.com"])
+    assert automaton.find_all("Visit EXAMPLE.com for spam") == {"spam", "example.com"}
+    assert automaton.find_all("nothing here") == set()
+
+
+def test_overlapping_and_nested_terms():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    assert automaton.find_all("ushers") == {"he", "she", "hers"}
+    assert automaton.find_all("ahishers") == {"he", "she", "his", "hers"}
+
+
+def test_empty_terms_never_match():
+    automaton = AhoCorasick(["", "spam"])
+    assert automaton.terms == frozenset({"spam"})
+    assert not AhoCorasick([]).search("anything")
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_find_all_agrees_with_substring_search(seed):
+    rng = random.Random(seed)
+    terms = ["".join(rng.choices("abc", k=rng.randint(1, 4))) for _ in range(rng.randint(1, 10))]
+    text = "".join(rng.choices("abcd", k=rng.randint(0, 50)))
+
+    automaton = AhoCorasick(terms)
+    expected = {term for term in terms if term in text}
+    assert automaton.find_all(text) == expected
+    assert automaton.search(text) == bool(expected)
+
+
+def test_message_matcher():
+    assert MessageMatcher(["spam"]).matches("SPAM offer")
+    assert not MessageMatcher(["spam"]).matches("see example.org")
+    assert MessageMatcher(urls=True).matches("see example.org")
+    assert not MessageMatcher().matches("anything")
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from outbound import BULK, INTERACTIVE, NORMAL, OutboundQueue
+
+
+def unlimited_queue(concurrency: int = 1) -> OutboundQueue:
+    return OutboundQueue(concurrency=concurrency, route_limits={}, global_limit=(10 ** 6, 1.0))
+
+
+def recorder(sent: list, name: str):
+    async def send():
+        sent.append(name)
+        return name
+    return send
+
+
+def test_more_urgent_requests_go_first():
+    async def main():
+        queue, sent = unlimited_queue(), []
+        futures = [
+            queue.submit(("send", 1), recorder(sent, "bulk"), priority=BULK),
+            queue.submit(("send", 2), recorder(sent, "normal"), priority=NORMAL),
+            queue.submit(("send", 3), recorder(sent, "interactive"), priority=INTERACTIVE),
+        ]
+        queue.start()
+        results = await asyncio.gather(*futures)
+        await queue.stop()
+        return sent, results
+
+    sent, results = asyncio.run(main())
+    assert sent == ["interactive", "normal", "bulk"]
+    assert results == ["bulk", "normal", "interactive"]
+
+
+def test_one_route_keeps_submission_order_within_a_priority():
+    async def main():
+        queue, sent = unlimited_queue(concurrency=4), []
+        futures = [queue.submit(("send", 1), recorder(sent, i)) for i in range(10)]
+        futures.append(queue.submit(("send", 1), recorder(sent, "urgent"), priority=INTERACTIVE))
+        queue.start()
+        await asyncio.gather(*futures)
+        await queue.stop()
+        return sent
+
+    assert asyncio.run(main()) == ["urgent"] + list(range(10))
+
+
+def test_queued_edits_of_one_message_are_coalesced():
+    async def main():
+        queue, sent = unlimited_queue(), []
+        futures = [queue.submit(("edit", 1), recorder(sent, f"edit {i}"), coalesce_key=42) for i in range(5)]
+        other = queue.submit(("edit", 1), recorder(sent, "other message"), coalesce_key=43)
+        queue.start()
+        results = await asyncio.gather(*futures, other)
+        await queue.stop()
+        return queue, sent, results
+
+    queue, sent, results = asyncio.run(main())
+    assert sent == ["edit 4", "other message"]
+    assert results == ["edit 4"] * 5 + ["other message"]
+    assert queue.coalesced == 4
+    assert queue.sent == 2
+
+
+def test_a_coalesced_edit_takes_the_most_urgent_priority():
+    async def main():
+        queue, sent = unlimited_queue(), []
+        first = queue.submit(("edit", 1), recorder(sent, "progress"), priority=BULK, coalesce_key=1)
+        normal = queue.submit(("edit", 1), recorder(sent, "normal"), priority=NORMAL)
+        latest = queue.submit(("edit", 1), recorder(sent, "result"), priority=INTERACTIVE, coalesce_key=1)
+        queue.start()
+        await asyncio.gather(first, normal, latest)
+        await queue.stop()
+        return sent
+
+    assert asyncio.run(main()) == ["result", "normal"]
+
+
+def test_a_failed_request_fails_its_future():
+    async def main():
+        queue = unlimited_queue()
+
+        async def fail():
+            raise RuntimeError("Discord is down")
+
+        queue.start()
+        future = queue.submit(("send", 1), fail)
+        with pytest.raises(RuntimeError):
+            await future
+        await queue.stop()
+        return queue.failed
+
+    assert asyncio.run(main()) == 1
+
+
+def test_bulk_work_leaves_workers_for_everything_else():
+    async def main():
+        queue, in_flight, peak = unlimited_queue(concurrency=4), [0], [0]
+
+        async def slow():
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            await asyncio.sleep(0.01)
+            in_flight[0] -= 1
+
+        queue.start()
+        await asyncio.gather(*[queue.submit(("delete", channel), slow, priority=BULK) for channel in range(20)])
+        await queue.stop()
+        return peak[0], queue.bulk_limit
+
+    peak, bulk_limit = asyncio.run(main())
+    assert peak == bulk_limit == 2
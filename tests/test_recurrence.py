@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from recurrence import EVERY_DAY, WEEKDAYS, WEEKENDS, describe_rule, next_occurrence, parse_rule
+from utils import DateParseError, get_timezone
+
+
+@pytest.mark.parametrize("text, rule", [
+    ("every 2h", {"every": 7200}),
+    ("Every 1d 30m", {"every": 88200}),
+    ("every day at 9am", {"days": EVERY_DAY, "at": 540, "tz": None}),
+    ("every weekdays at 09:00", {"days": WEEKDAYS, "at": 540, "tz": None}),
+    ("every weekend at 10am", {"days": WEEKENDS, "at": 600, "tz": None}),
+    ("every monday at 18:30", {"days": 0b1, "at": 1110, "tz": None}),
+    ("every mon,wed,fri at 9am", {"days": 0b10101, "at": 540, "tz": None}),
+    ("every tue and thu at 9am", {"days": 0b1010, "at": 540, "tz": None}),
+])
+def test_parse_rule(text, rule):
+    assert parse_rule(text) == rule
+
+
+def test_parse_rule_stores_the_time_zone():
+    assert parse_rule("every day at 9am", get_timezone("Europe/Berlin"))["tz"] == "Europe/Berlin"
+
+
+@pytest.mark.parametrize("text", [
+    "2h",
+    "every 1m",
+    "every 2h at 9am",
+    "every monday",
+    "every blursday at 9am",
+    "every t at 9am",
+])
+def test_parse_rule_rejects(text):
+    with pytest.raises(DateParseError):
+        parse_rule(text)
+
+
+def test_interval_skips_missed_occurrences_and_keeps_its_rhythm():
+    rule = {"every": 3600}
+    previous = datetime(2030, 1, 1, 12, 0)
+    assert next_occurrence(rule, previous, previous) == datetime(2030, 1, 1, 13, 0)
+    assert next_occurrence(rule, previous, datetime(2030, 1, 1, 15, 20)) == datetime(2030, 1, 1, 16, 0)
+    assert next_occurrence(rule, previous, datetime(2030, 1, 1, 16, 0)) == datetime(2030, 1, 1, 17, 0)
+
+
+def test_time_of_day_on_chosen_days():
+    # 2030-01-04 is a Friday.
+    friday = datetime(2030, 1, 4, 10, 0)
+    weekdays = {"days": WEEKDAYS, "at": 540, "tz": None}
+    assert next_occurrence(weekdays, friday, friday) == datetime(2030, 1, 7, 9, 0)
+    assert next_occurrence(weekdays, friday - timedelta(hours=2), friday - timedelta(hours=2)) == friday - timedelta(hours=1)
+
+    monday = {"days": 0b1, "at": 540, "tz": None}
+    assert next_occurrence(monday, datetime(2030, 1, 7, 9, 0), datetime(2030, 1, 7, 9, 0)) == datetime(2030, 1, 14, 9, 0)
+
+
+def test_time_of_day_in_another_time_zone():
+    zone = get_timezone("Asia/Kolkata")
+    rule = {"days": EVERY_DAY, "at": 540, "tz": "Asia/Kolkata"}
+    now = datetime.now()
+    occurrence = next_occurrence(rule, now, now)
+    local = occurrence.astimezone(zone)
+
+    assert now < occurrence <= now + timedelta(days=1)
+    assert (local.hour, local.minute) == (9, 0)
+
+
+def test_rule_without_days():
+    with pytest.raises(ValueError):
+        next_occurrence({"days": 0, "at": 540}, datetime.now(), datetime.now())
+
+
+@pytest.mark.parametrize("rule, description", [
+    ({"every": 90000}, "every 1d1h"),
+    ({"days": WEEKDAYS, "at": 540, "tz": None}, "every weekday at 09:00"),
+    ({"days": 0b10101, "at": 1110, "tz": "Europe/Berlin"}, "every Monday, Wednesday, Friday at 18:30 (Europe/Berlin)"),
+])
+def test_describe_rule(rule, description):
+    assert describe_rule(rule) == description
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+import asyncio
+
+import discord
+import pytest
+
+import scanning
+from scanning import GuildScan
+
+
+class HistoryChannel(discord.TextChannel):
+    "A text channel whose history is <messages>, oldest first. It subclasses TextChannel for GuildScan's isinstance() check."
+
+    def __init__(self, channel_id: int, message_ids) -> None:
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+        self.messages = [SimpleNamespace(id=message_id) for message_id in message_ids]
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=None):
+        for message in (self.messages if oldest_first else reversed(self.messages)):
+            if before is not None and message.id >= before.id or after is not None and message.id <= after.id:
+                continue
+            yield message
+
+
+class Interrupted(Exception):
+    pass
+
+
+def run_scan(guild, handled: list, stop_after: int = None, name: str = "test"):
+    async def handler(channel, batch):
+        if stop_after is not None and len(handled) >= stop_after:
+            raise Interrupted
+        handled.extend(message.id for message in batch)
+        return len(batch)
+
+    return asyncio.run(GuildScan(guild, name, handler, concurrency=1).run())
+
+
+def test_scan_handles_every_message_and_removes_its_checkpoint(mongo):
+    guild = SimpleNamespace(id=1, channels=[HistoryChannel(10, range(1, 251)), HistoryChannel(11, range(251, 301))])
+    handled = []
+    progress = run_scan(guild, handled)
+
+    assert sorted(handled) == list(range(1, 301))
+    assert (progress.channels, progress.channels_done, progress.messages, progress.matches) == (2, 2, 300, 300)
+    assert mongo.scan_checkpoints.count_documents({}) == 0
+
+
+def test_interrupted_scan_resumes_from_its_checkpoint(mongo):
+    channel = HistoryChannel(10, range(1, 501))
+    guild = SimpleNamespace(id=1, channels=[channel])
+    handled = []
+    with pytest.raises(Interrupted):
+        run_scan(guild, handled, stop_after=2 * scanning.BATCH_SIZE)
+    assert handled == list(range(500, 300, -1))
+    checkpoint = mongo.scan_checkpoints.find_one({"_id": "1:test"})
+    assert checkpoint["channels"]["10"] == {"before": 301, "after": 500, "done": False}
+
+    # Messages sent in the meantime are read too, and nothing is handled twice.
+    channel.messages.extend(SimpleNamespace(id=message_id) for message_id in range(501, 521))
+    resumed = []
+    progress = run_scan(guild, resumed)
+    assert sorted(handled + resumed) == list(range(1, 521))
+    assert progress.messages == 320
+    assert mongo.scan_checkpoints.count_documents({}) == 0
+
+
+def test_checkpoints_are_kept_apart_by_name_and_guild(mongo):
+    guild = SimpleNamespace(id=1, channels=[HistoryChannel(10, range(1, 301))])
+    with pytest.raises(Interrupted):
+        run_scan(guild, [], stop_after=scanning.BATCH_SIZE, name="remove_urls")
+
+    handled = []
+    run_scan(guild, handled, name="remove_text")
+    assert sorted(handled) == list(range(1, 301))
+    assert mongo.scan_checkpoints.find_one({"_id": "1:remove_urls"}) is not None
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from unittest import mock
+import asyncio
+
+import scheduler
+from scheduler import DeadlineScheduler
+
+
+async def nothing(keys):
+    pass
+
+
+def test_pop_due_returns_due_keys_in_deadline_order():
+    now = datetime.now()
+    deadlines = DeadlineScheduler(nothing, name="test")
+    deadlines.schedule("late", now - timedelta(seconds=1))
+    deadlines.schedule("early", now - timedelta(seconds=5))
+    deadlines.schedule("future", now + timedelta(hours=1))
+
+    assert deadlines.pop_due(now) == ["early", "late"]
+    assert list(deadlines._live) == ["future"]
+    assert deadlines.next_deadline() == now + timedelta(hours=1)
+
+
+def test_schedule_moves_a_pending_key():
+    now = datetime.now()
+    deadlines = DeadlineScheduler(nothing, name="test")
+    deadlines.schedule("key", now - timedelta(seconds=1))
+    deadlines.schedule("key", now + timedelta(hours=1))
+
+    assert deadlines.pop_due(now) == []
+    assert len(deadlines) == 1
+    assert deadlines.next_deadline() == now + timedelta(hours=1)
+
+
+def test_cancel_skips_the_key_and_compacts_the_heap():
+    now = datetime.now()
+    deadlines = DeadlineScheduler(nothing, name="test")
+    deadlines.schedule_many((key, now - timedelta(seconds=key)) for key in range(100))
+    for key in range(80):
+        assert deadlines.cancel(key)
+    assert not deadlines.cancel(0)
+
+    assert len(deadlines) == 20
+    assert len(deadlines._heap) < 100
+    assert sorted(deadlines.pop_due(now)) == list(range(80, 100))
+
+
+def test_runner_calls_back_when_the_deadline_passes():
+    async def main():
+        fired = []
+
+        async def callback(keys):
+            fired.extend(keys)
+
+        deadlines = DeadlineScheduler(callback, name="test")
+        deadlines.start()
+        deadlines.schedule("later", datetime.now() + timedelta(milliseconds=50))
+        deadlines.schedule("now", datetime.now())
+        await asyncio.sleep(0.2)
+        await deadlines.stop()
+        return fired
+
+    assert asyncio.run(main()) == ["now", "later"]
+
+
+def test_keys_of_a_failed_callback_are_retried():
+    async def main():
+        calls = []
+
+        async def callback(keys):
+            calls.append(list(keys))
+            if len(calls) == 1:
+                raise RuntimeError("the database is down")
+
+        deadlines = DeadlineScheduler(callback, name="test")
+        with mock.patch.object(scheduler, "RETRY_SECONDS", 0.05):
+            deadlines.start()
+            deadlines.schedule("key", datetime.now())
+            await asyncio.sleep(0.3)
+            await deadlines.stop()
+        return calls, len(deadlines)
+
+    calls, pending = asyncio.run(main())
+    assert calls == [["key"], ["key"]]
+    assert pending == 0
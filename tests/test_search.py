@@ -0,0 +1,58 @@
+from search import InvertedIndex, tokenize
+
+
+def test_tokenize_lowercases_and_drops_punctuation():
+    assert tokenize("Milk, EGGS & bread!") == ["milk", "eggs", "bread"]
+
+
+def test_search_ranks_title_matches_first():
+    index = InvertedIndex()
+    index.add("Groceries", "milk, eggs and bread")
+    index.add("Recipes", "pancakes need eggs, milk and flour. groceries list is elsewhere")
+    index.add("Work", "meeting at 10")
+
+    results = index.search("groceries")
+    assert [title for title, _ in results] == ["Groceries", "Recipes"]
+    assert results[0][1] > results[1][1] > 0
+    assert index.search("holiday") == []
+
+
+def test_search_limit():
+    index = InvertedIndex()
+    for i in range(20):
+        index.add(f"Note {i}", "eggs " * (i + 1))
+    assert len(index.search("eggs", limit=5)) == 5
+
+
+def test_remove_forgets_the_note_and_its_tokens():
+    index = InvertedIndex()
+    index.add("Groceries", "milk eggs")
+    index.add("Work", "meeting eggs")
+    index.remove("Groceries")
+    index.remove("Missing")
+
+    assert len(index) == 1
+    assert "milk" not in index.postings
+    assert [title for title, _ in index.search("eggs milk")] == ["Work"]
+
+
+def test_adding_a_note_again_replaces_it():
+    index = InvertedIndex()
+    index.add("Groceries", "milk")
+    size = index.size
+    index.add("Groceries", "eggs")
+
+    assert index.search("milk") == []
+    assert [title for title, _ in index.search("eggs")] == ["Groceries"]
+    assert index.total_length == index.doc_lengths["Groceries"]
+    assert index.size == size
+
+
+def test_empty_index():
+    index = InvertedIndex()
+    assert index.search("anything") == []
+    index.add("Note", "text")
+    index.remove("Note")
+    assert index.postings == {}
+    assert index.total_length == 0
+    assert index.size == 0
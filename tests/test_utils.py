@@ -0,0 +1,74 @@
+# Property tests for the date parser. Every test draws its input from a fixed seed, so a failure names the seed that
+# reproduces it.
+from datetime import datetime, timedelta
+import random
+
+import pytest
+
+from utils import DateParseError, get_timezone, parse_date_string, parse_duration, parse_time_of_day
+
+UNITS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+ZONES = ["UTC", "Europe/Berlin", "America/New_York", "Asia/Kolkata", "Pacific/Auckland"]
+SEEDS = range(200)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_duration_parts_in_any_order_case_and_spacing_add_up(seed):
+    rng = random.Random(seed)
+    chosen = rng.sample(list(UNITS), rng.randint(1, len(UNITS)))
+    amounts = {unit: rng.randint(0, 500) for unit in chosen}
+    text = rng.choice(["", " "]).join(
+        f"{amount}{rng.choice(['', ' '])}{rng.choice([unit, unit.upper()])}" for unit, amount in amounts.items()
+    )
+    expected = timedelta(seconds=sum(UNITS[unit] * amount for unit, amount in amounts.items()))
+
+    before = datetime.now()
+    parsed = parse_date_string(text)
+    assert before + expected <= parsed <= datetime.now() + expected, text
+    assert parse_duration(text) == expected, text
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_absolute_date_in_any_time_zone_is_the_same_instant(seed):
+    rng = random.Random(seed)
+    zone = get_timezone(rng.choice(ZONES))
+    date = datetime(rng.randint(2100, 2200), rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59))
+
+    parsed = parse_date_string(date.strftime("%Y-%m-%d %H:%M"), zone)
+    assert parsed.tzinfo is None
+    assert parsed.astimezone(zone).replace(tzinfo=None) == date
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_anything_else_raises_date_parse_error_only(seed):
+    rng = random.Random(seed)
+    alphabet = "0123456789wdhmsWDHMS:- Tapxyz"
+    for _ in range(50):
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 12)))
+        try:
+            parse_date_string(text)
+        except DateParseError:
+            pass
+
+
+@pytest.mark.parametrize("text", ["", "   ", "tomorrow", "1x", "2000-01-01", "2000-01-01 10:00", "25:00", "1d1d"])
+def test_rejects(text):
+    with pytest.raises(DateParseError):
+        parse_date_string(text)
+
+
+def test_time_without_a_date_is_the_next_time_the_clock_shows_it():
+    now = datetime.now()
+    parsed = parse_date_string("9am")
+    assert (parsed.hour, parsed.minute) == (9, 0)
+    assert now < parsed <= now + timedelta(days=1)
+
+
+@pytest.mark.parametrize("text, time", [("14:30", (14, 30)), ("2:30pm", (14, 30)), ("9am", (9, 0)), ("12am", (0, 0))])
+def test_parse_time_of_day(text, time):
+    assert parse_time_of_day(text) == time
+
+
+def test_unknown_time_zone():
+    with pytest.raises(DateParseError):
+        get_timezone("Mars/Olympus_Mons")
@@ -1,54 +1,294 @@
-from discord.ext import commands
-import discord
-import re
-
-
-class TextCog(commands.Cog, name="Text Stuff"):
-    def __init__(self, bot) -> None:
-        self.bot = bot
-
-    @commands.command()
-    async def remove_urls(self, ctx):
-        """
-        Removes all URLs from the entire server. 
-        """
-        await ctx.send("Scanning server contents. May take a while...")
-        for channel in ctx.guild.channels:
-            if isinstance(channel, discord.TextChannel):
-                async for message in channel.history(limit=1000):
-                    regex = r"[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
-                    match = re.search(regex, message.content)
-                    if match:
-                        await message.delete()
-        await ctx.send("Command finished.")
-
-    @commands.command()
-    async def copy_urls(self, ctx):
-        """
-        Copies all URLs from the entire server and shows you the list. This is best used before the 'remove_urls' command to ensure you don't nuke your server. 
-        """
-        await ctx.send("Scanning server contents. May take a while...")
-        for channel in ctx.guild.channels:
-            if isinstance(channel, discord.TextChannel):
-                async for message in channel.history(limit=1000):
-                    regex = r"[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
-                    match = re.search(regex, message.content)
-                    if match:
-                        await ctx.send(message.content)
-        await ctx.send("Command finished.")
-
-    @commands.command()
-    async def remove_text(self, ctx, text: str):
-        """
-        Removes all matches of the specified text from the entire server. 
-        """
-        await ctx.send("Scanning server contents. May take a while...")
-        for channel in ctx.guild.channels:
-            if isinstance(channel, discord.TextChannel):
-                async for message in channel.history(limit=1000):
-                    if text in message.content:
-                        await message.delete()
-        await ctx.send("Command finished.")
-
-async def setup(client):
-    await client.add_cog(TextCog(client))
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+from matching import URL_PATTERN, get_matcher
+from outbound import get_outbound_queue
+from scanning import GuildScan
+from tempfile import SpooledTemporaryFile
+from typing import IO, List, NamedTuple, Set, Tuple
+from zipfile import ZIP_DEFLATED, ZipFile
+import asyncio
+import csv
+import discord
+import io
+import logging
+import shutil
+
+
+logger = logging.getLogger('snuggly')
+
+
+# Discord's bulk-delete endpoint only accepts messages younger than 14 days. We keep a margin,
+# so a message doesn't turn 14 days old between the check and the request.
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=10)
+BULK_DELETE_MAX_MESSAGES = 100
+
+DRY_RUN = "--dry-run"
+TERMS = "--terms"
+
+# The URL list is kept in memory up to this size and spills over to disk beyond it.
+URL_SPOOL_SIZE = 1024 * 1024
+# Discord only allows file uploads of 8MB. Bigger URL lists are zipped, which shrinks them several times over.
+UPLOAD_LIMIT = 8 * 1024 * 1024
+
+
+async def delete_messages(channel: discord.TextChannel, messages: List[discord.Message]) -> Tuple[int, int]:
+    """
+    Deletes <messages>, which all belong to <channel>, and returns how many were deleted and how many couldn't be.
+
+    Messages younger than 14 days are deleted with one bulk-delete request per 100 messages. Older ones can only be
+    deleted one at a time. All of the requests go through the outbound queue as bulk work, so they are paced by
+    the channel's rate limits and never hold up replies to commands. A request Discord refuses, e.g. for lack of
+    permissions, is logged and its messages are counted as failed, so one bad request doesn't stop a server-wide scan.
+    """
+    cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+    recent = [message for message in messages if message.created_at > cutoff]
+    old = [message for message in messages if message.created_at <= cutoff]
+
+    queue = get_outbound_queue()
+    requests, sizes = [], []
+    for start in range(0, len(recent), BULK_DELETE_MAX_MESSAGES):
+        chunk = recent[start:start + BULK_DELETE_MAX_MESSAGES]
+        if len(chunk) == 1:
+            # The bulk-delete endpoint needs at least two messages.
+            old.append(chunk[0])
+            continue
+        requests.append(queue.delete_messages(channel, chunk))
+        sizes.append(len(chunk))
+    for message in old:
+        requests.append(queue.delete(message))
+        sizes.append(1)
+
+    deleted = failed = 0
+    errors = Counter()
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    for result, size in zip(results, sizes):
+        if isinstance(result, discord.NotFound):
+            continue
+        if isinstance(result, discord.HTTPException):
+            failed += size
+            errors[str(result)] += 1
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        deleted += size
+    for error, count in errors.items():
+        logger.warning(f"{count} requests to delete messages in #{channel.name} failed: {error}")
+    return deleted, failed
+
+
+class Token(NamedTuple):
+    # Where the word starts and ends in the command's text, and the word without its quotes.
+    start: int
+    end: int
+    word: str
+
+
+def parse_options(text: str, options: Set[str]) -> Tuple[Set[str], List[Token]]:
+    """
+    Splits a command's text into the <options> it contains, such as "--dry-run", and the other words, which are split
+    the way discord.py splits a command's arguments. Options may come anywhere in the text. Any other word that starts
+    with "--" raises BadArgument, so a mistyped option is never taken for text. Everything after a lone "--" is text.
+    """
+    view = StringView(text)
+    found, tokens = set(), []
+    while True:
+        view.skip_ws()
+        if view.eof:
+            break
+        start = view.index
+        word = view.get_quoted_word()
+        quoted = text[start] != word[:1]
+        if word == "--" and not quoted:
+            view.skip_ws()
+            if not view.eof:
+                tokens.append(Token(view.index, len(text), text[view.index:]))
+            break
+        if word.startswith("--") and not quoted:
+            if word not in options:
+                raise commands.BadArgument(f"Unknown option {word}. The options are {', '.join(sorted(options))}.")
+            found.add(word)
+        elif word:
+            tokens.append(Token(start, view.index, word))
+    return found, tokens
+
+
+def join_tokens(text: str, tokens: List[Token]) -> str:
+    """
+    Returns the text that <tokens> were parsed from, as it was written but without the options between them. Quotes
+    around the whole text aren't part of it, as they weren't when the text had to be one argument.
+    """
+    if len(tokens) == 1:
+        return tokens[0].word
+    parts = [text[tokens[0].start:tokens[0].end]]
+    for previous, token in zip(tokens, tokens[1:]):
+        gap = text[previous.end:token.start]
+        parts.append(gap if gap.isspace() else " ")
+        parts.append(text[token.start:token.end])
+    return "".join(parts)
+
+
+def _upload_file(spool: SpooledTemporaryFile, filename: str) -> discord.File:
+    # discord.File only takes io.IOBase objects, which SpooledTemporaryFile is only from Python 3.11 on. The file it
+    # wraps always is one, whether it is still in memory or has been rolled over to disk, and shares its position.
+    return discord.File(spool._file, filename=filename)
+
+
+def _zip_file(source: IO[bytes], name: str) -> IO[bytes]:
+    archive = SpooledTemporaryFile(max_size=URL_SPOOL_SIZE)
+    with ZipFile(archive, "w", compression=ZIP_DEFLATED) as zip, zip.open(name, "w", force_zip64=True) as entry:
+        shutil.copyfileobj(source, entry)
+    archive.seek(0)
+    return archive
+
+
+def removal_summary(counts: Counter, dry_run: bool, failed: int = 0) -> discord.Embed:
+    verb = "Would remove" if dry_run else "Removed"
+    lines = [f"<#{channel_id}>: {count}" for channel_id, count in counts.most_common(25)]
+    if len(counts) > 25:
+        lines.append(f"...and {len(counts) - 25} more channels")
+    if failed:
+        lines.append(f"Could not remove {failed} messages. Check that I'm allowed to manage messages everywhere.")
+    return discord.Embed(
+        title=f"{verb} {sum(counts.values())} messages",
+        description="\n".join(lines) or "Nothing matched.",
+        color=discord.Color.blue(),
+    )
+
+
+class TextCog(commands.Cog, name="Text Stuff"):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+    async def remove_matching(self, ctx, name: str, is_match, dry_run: bool):
+        """
+        Scans the whole server and removes every message for which <is_match> returns True.
+        With <dry_run>, matches are only counted.
+        """
+        counts = Counter()
+        failures = Counter()
+
+        async def handler(channel: discord.TextChannel, messages: List[discord.Message]) -> int:
+            matches = [message for message in messages if is_match(message)]
+            if matches and not dry_run:
+                deleted, failed = await delete_messages(channel, matches)
+                counts[channel.id] += deleted
+                failures[channel.id] += failed
+            elif matches:
+                counts[channel.id] += len(matches)
+            return len(matches)
+
+        status = await ctx.send("Scanning server contents. May take a while...")
+        # A dry run doesn't delete anything, so it must not share a checkpoint with a real run.
+        await GuildScan(ctx.guild, f"{name}:dry-run" if dry_run else name, handler, status=status).run()
+        await ctx.send(embed=removal_summary(counts, dry_run, sum(failures.values())))
+
+    @commands.command()
+    async def remove_urls(self, ctx, *, options: str = ""):
+        """
+        Removes all URLs from the entire server.
+
+        Usage:
+        > .remove_urls
+        > .remove_urls --dry-run
+        With --dry-run, nothing is removed and you are only told how many messages would be.
+        """
+        try:
+            flags, tokens = parse_options(options, {DRY_RUN})
+        except commands.UserInputError as e:
+            await ctx.send(str(e))
+            return
+        if tokens:
+            await ctx.send(f"This command takes no text, only {DRY_RUN}.")
+            return
+
+        def is_match(message: discord.Message) -> bool:
+            return URL_PATTERN.search(message.content) is not None
+
+        await self.remove_matching(ctx, "remove_urls", is_match, dry_run=DRY_RUN in flags)
+
+    @commands.command()
+    async def copy_urls(self, ctx):
+        """
+        Copies all URLs from the entire server and sends you the list as a CSV file, with the channel, message ID,
+        author and link to the message of each. Every URL is listed once. This is best used before the 'remove_urls'
+        command to ensure you don't nuke your server.
+        """
+        seen: Set[str] = set()
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        writer.writerow(["channel", "message_id", "author", "url", "message_link"])
+
+        with SpooledTemporaryFile(max_size=URL_SPOOL_SIZE) as spool:
+            async def handler(channel: discord.TextChannel, messages: List[discord.Message]) -> int:
+                matches = 0
+                for message in messages:
+                    found = False
+                    for match in URL_PATTERN.finditer(message.content):
+                        found = True
+                        url = match.group()
+                        if url not in seen:
+                            seen.add(url)
+                            writer.writerow([channel.name, message.id, str(message.author), url, message.jump_url])
+                    matches += found
+                # The rows of each batch are moved to the spool, so only one batch's worth is held as text.
+                spool.write(rows.getvalue().encode("utf-8"))
+                rows.seek(0)
+                rows.truncate()
+                return matches
+
+            status = await ctx.send("Scanning server contents. May take a while...")
+            # The list only exists in this command's memory, so an interrupted scan can't be resumed.
+            progress = await GuildScan(ctx.guild, "copy_urls", handler, status=status, resumable=False).run()
+            if not seen:
+                await ctx.send("There are no URLs in this server.")
+                return
+
+            name = f"{ctx.guild.name} - URLs.csv"
+            size = spool.tell()
+            spool.seek(0)
+            summary = f"Found {len(seen):,} different URLs in {progress.matches:,} messages."
+            if size <= UPLOAD_LIMIT:
+                await ctx.send(summary, file=_upload_file(spool, name))
+                return
+            loop = asyncio.get_running_loop()
+            with await loop.run_in_executor(None, _zip_file, spool, name) as archive:
+                await ctx.send(summary, file=_upload_file(archive, f"{name[:-4]}.zip"))
+
+    @commands.command()
+    async def remove_text(self, ctx, *, text: str = ""):
+        """
+        Removes every message that contains the specified text from the entire server. The text is matched as it is
+        written, including its case.
+
+        Usage:
+        > .remove_text buy now
+        > .remove_text buy now --dry-run
+        > .remove_text --terms spam "buy now" example.com
+        With --terms, every word is a separate term, and messages that contain any of them are removed whatever their
+        case. Put a term in quotes if it has spaces in it. With --dry-run, nothing is removed and you are only told how
+        many messages would be. Options can go anywhere. Put -- before text that starts with --.
+        """
+        try:
+            flags, tokens = parse_options(text, {DRY_RUN, TERMS})
+        except commands.UserInputError as e:
+            await ctx.send(str(e))
+            return
+        if not tokens:
+            await ctx.send("Please specify the text to remove.")
+            return
+        dry_run = DRY_RUN in flags
+
+        if TERMS not in flags:
+            phrase = join_tokens(text, tokens)
+            await self.remove_matching(ctx, "remove_text:" + phrase, lambda message: phrase in message.content, dry_run=dry_run)
+            return
+
+        # All terms are looked for in one pass over each message, however many there are.
+        matcher = get_matcher(ctx.guild.id, [token.word for token in tokens])
+        name = "remove_text:--terms:" + "|".join(sorted(matcher.terms))
+        await self.remove_matching(ctx, name, lambda message: matcher.matches(message.content), dry_run=dry_run)
+
+async def setup(client):
+    await client.add_cog(TextCog(client))
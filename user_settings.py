@@ -0,0 +1,95 @@
+# Contains the commands for the settings users can change for themselves.
+from datetime import datetime, tzinfo
+from discord.ext import commands
+from pymongo.database import Database as MongoDatabase
+from cache import LRUCache, MISSING
+from database import get_database, run
+from metrics import timed_methods
+from typing import Optional
+from utils import DateParseError, convert_date_to_readable_form, get_timezone
+import discord
+
+
+# user_id -> the user's time zone, or None if they haven't set one.
+timezone_cache = LRUCache(max_entries=10000, ttl=3600)
+
+
+@timed_methods
+class Database:
+    """
+    Stores every user's settings, one document per user: {"_id": user_id, "timezone": "Europe/Berlin"}
+    """
+
+    @staticmethod
+    def create_connection() -> MongoDatabase:
+        return get_database()
+
+    @staticmethod
+    async def get_settings(user_id: int) -> Optional[dict]:
+        db = Database.create_connection()
+        return await run(db.user_settings.find_one, {"_id": user_id})
+
+    @staticmethod
+    async def set_timezone(user_id: int, timezone: Optional[str]):
+        db = Database.create_connection()
+        update = {"$set": {"timezone": timezone}} if timezone else {"$unset": {"timezone": ""}}
+        await run(db.user_settings.update_one, {"_id": user_id}, update, upsert=True)
+
+
+async def get_user_timezone(user_id: int) -> Optional[tzinfo]:
+    "Returns the time zone the user has set, or None if they haven't. Dates they give are read in this time zone."
+    timezone = timezone_cache.get(user_id)
+    if timezone is not MISSING:
+        return timezone
+
+    token = timezone_cache.begin_fill(user_id)
+    settings = await Database.get_settings(user_id)
+    name = settings.get("timezone") if settings else None
+    timezone = get_timezone(name) if name else None
+    timezone_cache.fill(user_id, token, timezone)
+    return timezone
+
+
+class SettingsCog(commands.Cog, name="Settings"):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+    @commands.command()
+    async def timezone(self, ctx, name: str = None):
+        """
+        Sets the time zone that the dates and times you give to reminders and polls are read in.
+
+        Usage:
+        > .timezone Europe/Berlin
+        > .timezone reset
+        > .timezone
+        Without a time zone, shows the one you have set. The names are those of the IANA time zone database.
+        """
+        if name is None:
+            timezone = await get_user_timezone(ctx.author.id)
+            if timezone is None:
+                await ctx.send("You haven't set a time zone. Dates and times are read in the bot's time zone.")
+            else:
+                now = convert_date_to_readable_form(datetime.now(), timezone)
+                await ctx.send(f"Your time zone is **{timezone}**. It is {now} there.")
+            return
+
+        if name.lower() == "reset":
+            await Database.set_timezone(ctx.author.id, None)
+            timezone_cache.invalidate(ctx.author.id)
+            await ctx.send("Your time zone has been reset. Dates and times are read in the bot's time zone.")
+            return
+
+        try:
+            timezone = get_timezone(name)
+        except DateParseError as e:
+            await ctx.send(embed=discord.Embed(description=str(e)))
+            return
+        await Database.set_timezone(ctx.author.id, name)
+        timezone_cache.set(ctx.author.id, timezone)
+        now = convert_date_to_readable_form(datetime.now(), timezone)
+        await ctx.send(f"Your time zone is now **{name}**. It is {now} there.")
+
+
+async def setup(client):
+    await client.add_cog(SettingsCog(client))
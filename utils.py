@@ -1,126 +1,349 @@
-from __future__ import print_function
-import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.http import MediaFileUpload
-from datetime import datetime, timedelta
-import socket
-import requests
-import re
-
-
-# If modifying these scopes, delete the file token.json.
-SCOPES = [
-    "https://www.googleapis.com/auth/drive",
-]
-
-
-def parse_date_string(s) -> datetime:
-    # Read the "s" argument to figure out how many days, hours, and minutes until we remind the user.
-    days, hours, minutes = None, None, None
-    if "d" in s:
-        pattern = "\d+d"
-        match = re.search(pattern, s)
-        days = str(match.group()).replace("d", "")
-    
-    if "h" in s:
-        print(s)
-        pattern = "\d+h"
-        match = re.search(pattern, s, flags=re.IGNORECASE)
-        hours = str(match.group()).replace("h", "")
-    
-    if "m" in s:
-        pattern = "\d+m"
-        match = re.search(pattern, s)
-        minutes = str(match.group()).replace("m", "")
-    
-    # There is a possibility that the user does not enter a day or an hour or a minute. We check for that possiblity here using ternary operators.
-    date = datetime.today() + timedelta(
-        days=int(days if days else 0),
-        hours=int(hours if hours else 0),
-        minutes=int(minutes if minutes else 0),
-    )
-    return date
-
-def convert_date_to_readable_form(date: datetime) -> str:
-    return datetime.strftime(date, "%d %B, %I:%M %p")
-
-def set_up_gdrive_api():
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=8080)
-        # Save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-
-    socket.setdefaulttimeout(
-        3600
-    )  # Set the default timeout to 5 minutes. Because uploading large files to GDrive causes error.
-    drive = build("drive", "v3", credentials=creds)
-    return drive
-
-
-def upload_to_gdrive(fileObj):
-    """Shows basic usage of the Drive v3 API.
-    Prints the names and ids of the first 10 files the user has access to.
-    """
-    drive = set_up_gdrive_api()
-
-    with open(fileObj.filename, "rb") as file:
-        metadata = {"name": file.name}
-        media = MediaFileUpload(file.name, mimetype="image/jpeg")
-
-        f = drive.files().create(body=metadata, media_body=media, fields="id").execute()
-
-        file_id = f.get("id")
-        download_link = f"https://drive.google.com/u/0/uc?id={file_id}&export=download"
-
-        return {"download_link": download_link, "file_id": file_id}
-
-
-def delete_file_from_google_drive(file_id):
-    drive = set_up_gdrive_api()
-
-    deleted_file = drive.files().delete(field=file_id).execute()
-    return deleted_file
-
-
-def delete_downloaded_files():
-    for file in os.listdir():
-        if file.endswith(".jpg") or file.endswith(".zip"):
-            os.remove(file)
-
-
-def download_attachment(i, attachment):
-    url = attachment.url
-    response = requests.get(url)
-    with open(f"file00{i}-{attachment.filename}", "wb+") as file:
-        file.write(response.content)
-        return file.name
-
-
-def change_file_permissions_to_anyone(fileId):
-    drive = set_up_gdrive_api()
-
-    file_perms = (
-        drive.permissions()
-        .create(
-            fileId=fileId,
-            body={"role": "reader", "type": "anyone"},
-        )
-        .execute()
-    )
-
-    return file_perms
+from __future__ import print_function
+import os.path
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.http import MediaFileUpload
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, tzinfo
+from typing import Optional, Tuple
+import asyncio
+import functools
+import httplib2
+import metrics
+import mimetypes
+import threading
+import time
+import re
+import urllib.parse
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+# If modifying these scopes, delete the file token.json.
+SCOPES = [
+    "https://www.googleapis.com/auth/drive",
+]
+
+# Resumable uploads are sent in chunks of this size. Drive requires a multiple of 256KiB.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DRIVE_REQUEST_TIMEOUT = 300
+# Drive accepts at most 100 calls in one batch request.
+DRIVE_BATCH_SIZE = 100
+# Access tokens are refreshed this long before they expire.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# Points the Drive client at a different server, e.g. a local fake Drive API for testing.
+DRIVE_API_ENDPOINT = os.environ.get("GOOGLE_DRIVE_API_ENDPOINT")
+
+_drive = None
+_drive_credentials = None
+_drive_lock = threading.Lock()
+_drive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snuggly-drive")
+
+
+# A duration is one or more parts like "1w", "2d", "12h", "30m" or "45s", in any order, optionally separated by spaces.
+_DURATION_UNITS = {"w": "weeks", "d": "days", "h": "hours", "m": "minutes", "s": "seconds"}
+_DURATION_PART = re.compile(r"\s*(\d{1,12})\s*([wdhms])", re.IGNORECASE)
+# Most inputs are a single part like "1d", which doesn't need the loop.
+_SIMPLE_DURATION = re.compile(r"(\d{1,12})([wdhms])", re.IGNORECASE)
+# An absolute date and/or time: "2024-05-01", "2024-05-01 14:30", "2024-05-01T2:30pm", "14:30", "2:30pm" or "9am".
+_ABSOLUTE_DATE = re.compile(
+    r"(?:(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2}))?"
+    r"(?:(?(year)[ T]|)(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<meridiem>am|pm)?)?",
+    re.IGNORECASE,
+)
+
+
+class DateParseError(ValueError):
+    """
+    Raised when a date string can't be parsed. <position> is the index in the string where parsing failed.
+    """
+
+    def __init__(self, message: str, position: int = 0) -> None:
+        super().__init__(message)
+        self.position = position
+
+
+def parse_date_string(s: str, tz: Optional[tzinfo] = None) -> datetime:
+    """
+    Returns the date <s> refers to, as a naive datetime in the bot's local time like every date the bot stores.
+
+    <s> is either a duration from now, like "1d", "1w2d", "6h30m" or "90s", or an absolute date and/or time like
+    "2024-05-01", "2024-05-01 14:30", "14:30", "2:30pm" or "9am". Absolute dates are read in the time zone <tz>, or in the
+    bot's local time zone if it is None. A time without a date is the next time the clock shows it.
+
+    Raises DateParseError if <s> can't be parsed or refers to a date that has passed.
+    """
+    s = s.strip()
+    if not s:
+        raise DateParseError("No date or duration was given.")
+
+    if "-" in s or ":" in s or s[-2:].lower() in ("am", "pm"):
+        return _parse_absolute_date(s, tz)
+    try:
+        return datetime.now() + parse_duration(s)
+    except OverflowError:
+        raise DateParseError(f"\"{s}\" is too far in the future.") from None
+
+
+def parse_duration(s: str) -> timedelta:
+    """
+    Returns the duration <s> stands for, like "1d", "1w2d", "6h 30m" or "90s". Raises DateParseError if it can't be parsed.
+    """
+    s = s.strip()
+    # The fast path for the most common input, a single duration part.
+    match = _SIMPLE_DURATION.fullmatch(s)
+    if match:
+        parts = {_DURATION_UNITS[match.group(2).lower()]: int(match.group(1))}
+    else:
+        parts = {}
+        position = 0
+        while position < len(s) or not parts:
+            match = _DURATION_PART.match(s, position)
+            if match is None:
+                raise DateParseError(
+                    f"Could not understand \"{s[position:].strip()}\" in \"{s}\" at position {position + 1}. "
+                    f"Durations are numbers followed by w, d, h, m or s, like 1d6h.",
+                    position,
+                )
+            unit = _DURATION_UNITS[match.group(2).lower()]
+            if unit in parts:
+                raise DateParseError(f"\"{match.group(2)}\" appears more than once in \"{s}\".", match.start(2))
+            parts[unit] = int(match.group(1))
+            position = match.end()
+    try:
+        return timedelta(**parts)
+    except OverflowError:
+        raise DateParseError(f"\"{s}\" is too long a duration.") from None
+
+
+def _read_time_of_day(match: "re.Match") -> Tuple[int, int]:
+    meridiem = (match.group("meridiem") or "").lower()
+    if match.group("minute") is None and not meridiem:
+        raise DateParseError(f"Could not understand \"{match.group()}\". Times look like 14:30, 2:30pm or 9am.", match.start("hour"))
+    hour, minute = int(match.group("hour")), int(match.group("minute") or 0)
+    if meridiem and not 1 <= hour <= 12:
+        raise DateParseError(f"{hour} isn't an hour on a 12-hour clock.", match.start("hour"))
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    if hour > 23 or minute > 59:
+        raise DateParseError(f"{match.group()} isn't a time of day.", match.start("hour"))
+    return hour, minute
+
+
+def parse_time_of_day(s: str) -> Tuple[int, int]:
+    "Returns the (hour, minute) of a time like \"14:30\" or \"2:30pm\". Raises DateParseError if it can't be parsed."
+    match = _ABSOLUTE_DATE.fullmatch(s.strip())
+    if match is None or match.group("year") is not None or match.group("hour") is None:
+        raise DateParseError(f"Could not understand \"{s}\". Times look like 14:30, 2:30pm or 9am.")
+    return _read_time_of_day(match)
+
+
+def _parse_absolute_date(s: str, tz: Optional[tzinfo]) -> datetime:
+    match = _ABSOLUTE_DATE.fullmatch(s)
+    if match is None or (match.group("year") is None and match.group("hour") is None):
+        raise DateParseError(
+            f"Could not understand \"{s}\". Dates look like 2024-05-01 or 2024-05-01 14:30, and times like 14:30 or 2:30pm."
+        )
+
+    now = datetime.now(tz).replace(tzinfo=None) if tz is not None else datetime.now()
+    hour, minute = _read_time_of_day(match) if match.group("hour") is not None else (0, 0)
+    try:
+        if match.group("year") is not None:
+            date = datetime(int(match.group("year")), int(match.group("month")), int(match.group("day")), hour, minute)
+        else:
+            date = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if date <= now:
+                date += timedelta(days=1)
+    except ValueError as e:
+        raise DateParseError(f"\"{s}\" isn't a valid date: {e}.") from None
+
+    if date <= now:
+        raise DateParseError(f"{convert_date_to_readable_form(date)} has already passed.")
+    if tz is not None:
+        # Converted to the bot's local time, in which all dates are stored.
+        date = date.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+    return date
+
+
+def get_timezone(name: str) -> tzinfo:
+    "Returns the IANA time zone called <name>, e.g. \"Europe/Berlin\". Raises DateParseError if there is no such zone."
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise DateParseError(f"\"{name}\" isn't a time zone. Time zones look like Europe/Berlin or America/New_York.") from None
+
+
+def convert_date_to_readable_form(date: datetime, tz: Optional[tzinfo] = None) -> str:
+    "Formats <date>, a naive datetime in the bot's local time. With <tz>, it is shown in that time zone instead."
+    if tz is not None:
+        date = date.astimezone(tz)
+    return datetime.strftime(date, "%d %B, %I:%M %p")
+
+def _load_credentials() -> Credentials:
+    creds = None
+    # The file token.json stores the user's access and refresh tokens, and is
+    # created automatically when the authorization flow completes for the first
+    # time.
+    if os.path.exists("token.json"):
+        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            creds = flow.run_local_server(port=8080)
+        _save_credentials(creds)
+    return creds
+
+
+def _save_credentials(creds: Credentials):
+    # Save the credentials for the next run
+    with open("token.json", "w") as token:
+        token.write(creds.to_json())
+
+
+def set_up_gdrive_api():
+    """
+    Returns the Drive client, building it on first use. The client is cached, so token.json and the discovery document
+    are only read once. Access tokens are refreshed a few minutes before they expire rather than after a request fails.
+    """
+    global _drive, _drive_credentials
+    with _drive_lock:
+        if _drive is None:
+            _drive_credentials = _load_credentials()
+            # Uploads are sent in chunks, so no single request should take longer than this.
+            http = httplib2.Http(timeout=DRIVE_REQUEST_TIMEOUT)
+            # Resumable uploads answer with "308 Resume Incomplete", which must not be followed like a redirect.
+            http.redirect_codes = http.redirect_codes - {308}
+            http = AuthorizedHttp(_drive_credentials, http=http)
+            client_options = {"api_endpoint": DRIVE_API_ENDPOINT} if DRIVE_API_ENDPOINT else None
+            _drive = build("drive", "v3", http=http, client_options=client_options, static_discovery=True)
+        elif _drive_credentials.expiry and _drive_credentials.expiry - TOKEN_REFRESH_MARGIN <= datetime.utcnow():
+            _drive_credentials.refresh(Request())
+            _save_credentials(_drive_credentials)
+    return _drive
+
+
+async def run_on_drive_executor(func, *args, **kwargs):
+    """
+    Runs a blocking Drive call off the event loop. The Drive client's HTTP connection isn't thread-safe,
+    so every Drive call goes through the same single thread.
+    """
+    loop = asyncio.get_running_loop()
+    if not metrics.is_enabled():
+        return await loop.run_in_executor(_drive_executor, functools.partial(func, *args, **kwargs))
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_drive_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        metrics.DRIVE_SECONDS.observe(time.perf_counter() - start, func.__name__)
+
+
+class _ChunkedFileUpload(MediaFileUpload):
+    """
+    Sends every chunk as bytes read from the file rather than as a slice of the file stream. httplib2 resends a request
+    once when the connection drops, and a stream slice would be empty by then, so the resent request would announce a
+    chunk, send nothing and wait for an answer until DRIVE_REQUEST_TIMEOUT. Only one chunk is held in memory at a time.
+    """
+
+    def has_stream(self):
+        return False
+
+
+def upload_to_gdrive(file_path, progress=None, retries=5):
+    """
+    Uploads the file at <file_path> to Google Drive with a resumable upload, in chunks of UPLOAD_CHUNK_SIZE.
+
+    param <progress>: An optional function that is called with (bytes_uploaded, total_bytes) after every chunk.
+    param <retries>: How many times a failed chunk is retried. Each retry resumes from the last byte Drive received.
+    """
+    drive = set_up_gdrive_api()
+
+    mimetype = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    metadata = {"name": os.path.basename(file_path)}
+    media = _ChunkedFileUpload(file_path, mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    request = drive.files().create(body=metadata, media_body=media, fields="id")
+    if DRIVE_API_ENDPOINT:
+        # The client moves uploads to the endpoint's host but keeps https, which a local fake Drive API doesn't serve.
+        scheme = urllib.parse.urlsplit(DRIVE_API_ENDPOINT).scheme
+        request.uri = urllib.parse.urlsplit(request.uri)._replace(scheme=scheme).geturl()
+
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            # Retries are handled here rather than by next_chunk(num_retries=...), which would resend the whole chunk.
+            # After a failure the request remembers the upload session, and the next call first asks Drive how many
+            # bytes it has received and continues from there.
+            status, response = request.next_chunk()
+        except (HttpError, OSError, httplib2.HttpLib2Error) as e:
+            failures += 1
+            if failures > retries or (isinstance(e, HttpError) and e.resp.status < 500 and e.resp.status != 429):
+                raise
+            time.sleep(min(2 ** failures, 60))
+            continue
+
+        failures = 0
+        if status is not None and progress is not None:
+            progress(status.resumable_progress, status.total_size)
+
+    if progress is not None:
+        progress(media.size(), media.size())
+
+    file_id = response.get("id")
+    download_link = f"https://drive.google.com/u/0/uc?id={file_id}&export=download"
+
+    return {"download_link": download_link, "file_id": file_id}
+
+
+def delete_file_from_google_drive(file_id):
+    drive = set_up_gdrive_api()
+
+    deleted_file = drive.files().delete(fileId=file_id).execute()
+    return deleted_file
+
+
+def delete_files_from_google_drive(file_ids) -> dict:
+    """
+    Deletes many files with batch requests of up to 100 deletions each. Returns a dict that maps every file ID to
+    None if it was deleted (or was already gone) and to the error otherwise.
+    """
+    drive = set_up_gdrive_api()
+    results = {}
+
+    def callback(request_id, response, exception):
+        if isinstance(exception, HttpError) and exception.resp.status == 404:
+            exception = None
+        results[request_id] = exception
+
+    file_ids = list(file_ids)
+    for start in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+        batch = drive.new_batch_http_request(callback=callback)
+        for file_id in file_ids[start:start + DRIVE_BATCH_SIZE]:
+            batch.add(drive.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute()
+
+    return results
+
+
+def change_file_permissions_to_anyone(fileId):
+    drive = set_up_gdrive_api()
+
+    file_perms = (
+        drive.permissions()
+        .create(
+            fileId=fileId,
+            body={"role": "reader", "type": "anyone"},
+        )
+        .execute()
+    )
+
+    return file_perms